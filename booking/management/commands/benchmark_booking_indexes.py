@@ -0,0 +1,211 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from booking.models import ACTIVE_BOOKING_STATUSES, Booking
+from booking.utils import local_day_range
+from garage.models import Garage, ParkingSpot
+
+# Rough production mix: most bookings end up completed
+STATUS_WEIGHTS = {
+    "completed": 80,
+    "cancelled": 8,
+    "expired": 8,
+    "pending": 2,
+    "confirmed": 1,
+    "confirmed_late": 1,
+}
+SEED_BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed bookings inside a transaction, run the booking hot-path queries without and with "
+        "the Booking Meta indexes and report query plans and timings. Everything is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help="Bookings to seed.")
+        parser.add_argument('--drivers', type=int, default=20_000)
+        parser.add_argument('--garages', type=int, default=200)
+        parser.add_argument('--spots', type=int, default=50, help="Spots per garage.")
+        parser.add_argument('--days', type=int, default=180, help="Spread created_at over this many days.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per query, the best one is reported.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            raise CommandError(f"{connection.vendor} can't roll back DDL; run this against SQLite or PostgreSQL.")
+
+        self.rng = random.Random(options['seed'])
+        self.repeat = options['repeat']
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            probe = self.seed(options)
+            self.stdout.write(f"Seeded {options['rows']} bookings in {time.perf_counter() - started:.1f}s")
+
+            queries = self.queries(*probe)
+            # Not entered as a context manager: SQLite refuses that inside atomic(),
+            # but plain CREATE/DROP INDEX statements are fine in the open transaction
+            editor = connection.schema_editor()
+            editor.deferred_sql = []
+            existing = self.existing_indexes()
+            for index in Booking._meta.indexes:
+                if index.name in existing:
+                    editor.remove_index(Booking, index)
+            self.analyze()
+            before = self.run(queries, "without Booking indexes")
+
+            for index in Booking._meta.indexes:
+                editor.add_index(Booking, index)
+            self.analyze()
+            after = self.run(queries, "with Booking indexes")
+
+            self.stdout.write(self.style.MIGRATE_HEADING("\nSummary (best of %d, ms)" % self.repeat))
+            for label in queries:
+                self.stdout.write(
+                    f"  {label:<28} {before[label]:>10.2f} -> {after[label]:>9.2f}"
+                    f"  ({before[label] / max(after[label], 1e-6):.1f}x)"
+                )
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("Rolled back the seeded data and index changes."))
+
+    def seed(self, options):
+        rng = self.rng
+        now = timezone.now()
+        tag = f"bench{int(time.time())}"
+
+        owner = CustomUser.objects.create(
+            email=f"{tag}-owner@example.com", username=f"{tag}-owner",
+            phone=f"{tag[-9:]}000000", national_id="9" * 14, role='garage_owner',
+        )
+        drivers = CustomUser.objects.bulk_create(
+            (
+                CustomUser(
+                    email=f"{tag}-{i}@example.com", username=f"{tag}-{i}",
+                    phone=f"{tag[-6:]}{i:09d}", national_id=f"8{i:013d}", role='driver',
+                )
+                for i in range(options['drivers'])
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        garages = Garage.objects.bulk_create(
+            Garage(
+                owner=owner, name=f"{tag} {i}", address="Cairo",
+                latitude=30 + rng.random(), longitude=31 + rng.random(),
+                opening_hour=datetime.time(0, 0), closing_hour=datetime.time(23, 59),
+                contract_document="garage_contracts/contract.pdf",
+                verification_status='Verified', price_per_hour=Decimal("20.00"),
+            )
+            for i in range(options['garages'])
+        )
+        ParkingSpot.objects.bulk_create(
+            (
+                ParkingSpot(garage=garage, slot_number=f"SLOT-{n:03d}")
+                for garage in garages for n in range(1, options['spots'] + 1)
+            ),
+            batch_size=SEED_BATCH_SIZE,
+        )
+        spots = {}
+        for spot_id, garage_id in ParkingSpot.objects.filter(garage__in=garages).values_list('id', 'garage_id'):
+            spots.setdefault(garage_id, []).append(spot_id)
+
+        driver_ids = [d.id for d in drivers]
+        garage_ids = [g.id for g in garages]
+        statuses, weights = zip(*STATUS_WEIGHTS.items())
+        window = options['days'] * 86400
+
+        def bookings(count):
+            for _ in range(count):
+                garage_id = rng.choice(garage_ids)
+                created = now - datetime.timedelta(seconds=rng.randrange(window))
+                status = rng.choices(statuses, weights)[0]
+                start = end = cost = None
+                if status == "completed":
+                    start = created + datetime.timedelta(minutes=rng.randrange(5, 30))
+                    end = start + datetime.timedelta(minutes=rng.randrange(15, 300))
+                    cost = Decimal(rng.randrange(10, 200))
+                yield Booking(
+                    driver_id=rng.choice(driver_ids), garage_id=garage_id,
+                    parking_spot_id=rng.choice(spots[garage_id]),
+                    reservation_expiry_time=created + datetime.timedelta(minutes=15),
+                    created_at=created, start_time=start, end_time=end,
+                    actual_cost=cost, status=status,
+                )
+
+        # created_at is auto_now_add; switch it off so the rows spread over the window
+        created_field = Booking._meta.get_field('created_at')
+        created_field.auto_now_add = False
+        try:
+            remaining = options['rows']
+            while remaining:
+                batch = min(remaining, SEED_BATCH_SIZE)
+                Booking.objects.bulk_create(bookings(batch), batch_size=batch)
+                remaining -= batch
+        finally:
+            created_field.auto_now_add = True
+
+        return rng.choice(driver_ids), rng.choice(garage_ids)
+
+    def queries(self, driver_id, garage_id):
+        now = timezone.now()
+        day_start, day_end = local_day_range()
+        return {
+            "initiate: active booking": lambda: Booking.objects.filter(
+                driver_id=driver_id, status__in=ACTIVE_BOOKING_STATUSES, reservation_expiry_time__gt=now,
+            ),
+            "active booking view": lambda: Booking.objects.filter(driver_id=driver_id).exclude(
+                status__in=["cancelled", "expired", "completed"]
+            ).order_by("-created_at")[:1],
+            "recent exit summary": lambda: Booking.objects.filter(
+                driver_id=driver_id, status="completed", end_time__gte=now - datetime.timedelta(seconds=30),
+            ).order_by("-end_time")[:1],
+            "dashboard: today revenue": lambda: Booking.objects.filter(
+                garage_id=garage_id, end_time__gte=day_start, end_time__lt=day_end, actual_cost__isnull=False,
+            ).values("garage_id").annotate(total=Sum("actual_cost")),
+            "dashboard: today bookings": lambda: Booking.objects.filter(
+                garage_id=garage_id, created_at__gte=day_start, created_at__lt=day_end,
+            ).exclude(status__in=["cancelled", "expired"]).order_by("-created_at"),
+            "weekly report": lambda: Booking.objects.filter(
+                garage_id=garage_id, created_at__gte=now - datetime.timedelta(days=7),
+            ),
+            "sweeper: due pending": lambda: Booking.objects.filter(
+                status="pending", reservation_expiry_time__lte=now,
+            ).order_by("reservation_expiry_time")[:500],
+        }
+
+    def run(self, queries, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {title} ==="))
+        timings = {}
+        for label, build in queries.items():
+            self.stdout.write(self.style.MIGRATE_LABEL(label))
+            self.stdout.write("  " + build().explain().replace("\n", "\n  "))
+            best = float("inf")
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(build())
+                best = min(best, time.perf_counter() - started)
+            timings[label] = best * 1000
+            self.stdout.write(f"  {timings[label]:.2f} ms")
+        return timings
+
+    def existing_indexes(self):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, Booking._meta.db_table))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(Booking._meta.db_table)}")
+            else:
+                cursor.execute("ANALYZE")
@@ -5,6 +5,10 @@ from accounts.models import CustomUser
 from garage.models import ParkingSpot, Garage
 from django.core.validators import FileExtensionValidator
 
+# Bookings in these states hold a spot and block the driver from booking again
+ACTIVE_BOOKING_STATUSES = ("pending", "confirmed", "confirmed_late", "awaiting_response")
+
+
 class Booking(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -38,6 +42,7 @@ class Booking(models.Model):
         help_text="التكلفة الفعلية (مدة الانتظار + مدة الركن)"
     )
 
+    # Legacy: QR codes are now rendered on demand by booking.views.booking_qr_code
     qr_code_image = models.ImageField(
         upload_to='qr_codes/',
         null=True,
@@ -102,4 +107,19 @@ class Booking(models.Model):
         return f"Booking {self.id} — {self.driver.email}"
 
     class Meta:
-        ordering = ["-created_at"]
\ No newline at end of file
+        ordering = ["-created_at"]
+        indexes = [
+            # Used by the sweep_bookings task to find due bookings
+            models.Index(fields=["status", "reservation_expiry_time"], name="booking_status_expiry_idx"),
+            # "Does this driver already have a booking?" (initiate view / serializer)
+            models.Index(
+                fields=["driver", "reservation_expiry_time"],
+                condition=models.Q(status__in=ACTIVE_BOOKING_STATUSES),
+                name="booking_driver_active_idx",
+            ),
+            # Active booking / recent exit summary
+            models.Index(fields=["driver", "status", "end_time"], name="booking_driver_status_end_idx"),
+            # Owner dashboard and weekly reports, always scoped to one garage and a time window
+            models.Index(fields=["garage", "created_at"], name="booking_garage_created_idx"),
+            models.Index(fields=["garage", "end_time"], name="booking_garage_end_idx"),
+        ]
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from booking.models import Booking
+from booking.models import ACTIVE_BOOKING_STATUSES, Booking
+from booking.utils import booking_qr_url
 
 # ───────────── BookingDetailSerializer ─────────────
 
@@ -21,6 +22,7 @@ class BookingDetailSerializer(serializers.ModelSerializer):
     total_duration_minutes = serializers.SerializerMethodField()
     actual_cost           = serializers.SerializerMethodField()
     late_alert_sent = serializers.BooleanField(read_only=True)
+    qr_code_image = serializers.SerializerMethodField()
 
 
     class Meta:
@@ -38,6 +40,11 @@ class BookingDetailSerializer(serializers.ModelSerializer):
     def _minutes(self, td):
         return int(td.total_seconds() // 60) if td else None
 
+    def get_qr_code_image(self, obj):
+        url = booking_qr_url(obj)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def get_wallet_balance(self, obj):
         return float(obj.driver.wallet_balance)
 
@@ -59,7 +66,7 @@ from django.utils import timezone
 from rest_framework import serializers
 
 from garage.models import Garage, ParkingSpot
-from booking.models import Booking
+from booking.models import ACTIVE_BOOKING_STATUSES, Booking
 
 
 class BookingInitiationSerializer(serializers.Serializer):
@@ -107,7 +114,7 @@ class BookingInitiationSerializer(serializers.Serializer):
         # ───── Validate: User doesn't already have active booking ─────
         if Booking.objects.filter(
             driver=user,
-            status__in=["pending", "confirmed", "confirmed_late", "awaiting_response"],
+            status__in=ACTIVE_BOOKING_STATUSES,
             # is_cancelled=False,
             end_time__isnull=True
         ).exists():
@@ -1,90 +1,126 @@
 from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from django.core.mail import send_mail
 
 from booking.models import Booking
+from booking.utils import send_booking_confirmation_email
+from garage.events import publish_booking_event
+from garage.models import ParkingSpot
 
+User = get_user_model()
 
-@shared_task
-def notify_before_expiry(booking_id: int) -> None:
-    try:
-        booking = (
-            Booking.objects
-            .select_related("driver", "garage")
-            .get(id=booking_id)
-        )
+FROM_EMAIL = "Parking System <noreply@parking.com>"
 
-        # If already confirmed_late, don't send notification
-        if (
-            booking.status == "pending"
-            and not booking.late_alert_sent
-            and booking.confirmed_late_at is None
-            and timezone.now() >= booking.reservation_expiry_time
-        ):
-            user = booking.driver
-            garage_name = booking.garage.name
-
-            subject = "⏰ Booking Time Expired – Action Required"
-            body = (
-                f"Hello {user.first_name},\n\n"
-                f"Your reservation time at **{garage_name}** has expired.\n"
-                f"You can now:\n"
-                f"• Click (Confirm) to proceed with the booking and pay, or\n"
-                f"• Click (Cancel), which will result in a temporary block.\n\n"
-                f"Thank you,\n"
-                f"Parking System"
-            )
-
-            send_mail(
-                subject,
-                body,
-                "Parking System <noreply@parking.com>",
-                [user.email],
-                fail_silently=True,
-            )
-
-            booking.late_alert_sent = True
-            booking.status = "awaiting_response"
-            booking.save(update_fields=["late_alert_sent", "status"])
-
-            print(
-                f"[notify_before_expiry] booking {booking_id} → awaiting_response; mail sent to {user.email}"
-            )
+# Max bookings handled per phase in one sweep, so a backlog can't turn into one huge transaction
+SWEEP_BATCH_SIZE = getattr(settings, "BOOKING_SWEEP_BATCH_SIZE", 500)
+# Time a driver has to answer the "time is up" notice before the booking is expired
+EXPIRY_RESPONSE_WINDOW = timedelta(minutes=1)
+# Time a late-confirmed driver has to enter the garage
+LATE_ENTRY_WINDOW = timedelta(hours=1)
+LATE_NO_ENTRY_BLOCK = timedelta(minutes=24)
 
-    except Booking.DoesNotExist:
-        print(f"[notify_before_expiry] booking {booking_id} not found")
+EXPIRABLE_STATUSES = ("pending", "awaiting_response")
+
+
+def queue_booking_confirmation(booking_id: int) -> None:
+    """
+    Send the confirmation email (with the QR rendered inline) from a worker.
+    Call it from transaction.on_commit so workers never see an uncommitted booking.
+    """
+    email_booking_confirmation.delay(booking_id)
 
 
 @shared_task
-def expire_or_block_booking(booking_id: int) -> None:
+def email_booking_confirmation(booking_id: int) -> None:
     try:
-        booking = (
-            Booking.objects
-            .select_related("parking_spot", "driver", "garage")
-            .get(id=booking_id)
-        )
-        now = timezone.now()
+        booking = Booking.objects.select_related("driver", "garage", "parking_spot").get(id=booking_id)
+    except Booking.DoesNotExist:
+        print(f"[email_booking_confirmation] booking {booking_id} not found")
+        return
 
-        if booking.status in ("confirmed", "confirmed_late", "completed", "awaiting_payment"):
-            return
+    send_booking_confirmation_email(booking)
 
-        if now < booking.reservation_expiry_time:
-            return
 
-        booking.status = "expired"
-        booking.save(update_fields=["status"])
+def _send_emails(messages):
+    if messages:
+        get_connection(fail_silently=True).send_messages(messages)
 
-        spot = booking.parking_spot
-        spot.status = "available"
-        spot.save(update_fields=["status"])
 
+def _lock_batch(queryset, batch_size):
+    # skip_locked lets overlapping sweeps split the work instead of waiting on each other
+    return list(
+        queryset
+        .select_related("driver", "garage")
+        .select_for_update(skip_locked=True, of=("self",))
+        .order_by("reservation_expiry_time")[:batch_size]
+    )
+
+
+def notify_expired_bookings(queryset, batch_size=SWEEP_BATCH_SIZE) -> int:
+    """
+    Move pending bookings whose grace period ended to awaiting_response
+    and ask their drivers to confirm or cancel.
+    """
+    with transaction.atomic():
+        bookings = _lock_batch(
+            queryset.filter(status="pending", late_alert_sent=False, confirmed_late_at__isnull=True),
+            batch_size,
+        )
+        Booking.objects.filter(id__in=[b.id for b in bookings]).update(
+            status="awaiting_response", late_alert_sent=True
+        )
+
+    messages = []
+    for booking in bookings:
+        user = booking.driver
+        body = (
+            f"Hello {user.first_name},\n\n"
+            f"Your reservation time at **{booking.garage.name}** has expired.\n"
+            f"You can now:\n"
+            f"• Click (Confirm) to proceed with the booking and pay, or\n"
+            f"• Click (Cancel), which will result in a temporary block.\n\n"
+            f"Thank you,\n"
+            f"Parking System"
+        )
+        messages.append(EmailMessage("⏰ Booking Time Expired – Action Required", body, FROM_EMAIL, [user.email]))
+    _send_emails(messages)
+
+    return len(bookings)
+
+
+def expire_bookings(queryset, now, batch_size=SWEEP_BATCH_SIZE) -> int:
+    """
+    Expire unconfirmed bookings, free their spots and temporarily block their drivers.
+    """
+    with transaction.atomic():
+        bookings = _lock_batch(queryset.filter(status__in=EXPIRABLE_STATUSES), batch_size)
+        if not bookings:
+            return 0
+
+        Booking.objects.filter(id__in=[b.id for b in bookings]).update(status="expired")
+        ParkingSpot.objects.filter(id__in=[b.parking_spot_id for b in bookings]).transition("available")
+        for booking in bookings:
+            booking.status = "expired"
+            publish_booking_event(booking, "expired")
+
+        drivers = {}
+        for booking in bookings:
+            block_hours = getattr(booking.garage, "block_duration_hours", 3) or 1
+            driver = drivers.setdefault(booking.driver_id, booking.driver)
+            blocked_until = now + timedelta(hours=block_hours)
+            if not driver.blocked_until or driver.blocked_until < blocked_until:
+                driver.blocked_until = blocked_until
+        User.objects.bulk_update(drivers.values(), ["blocked_until"])
+
+    messages = []
+    for booking in bookings:
         driver = booking.driver
         block_hours = getattr(booking.garage, "block_duration_hours", 3) or 1
-        driver.blocked_until = now + timedelta(hours=block_hours)
-        driver.save(update_fields=["blocked_until"])
-
-        subject = "Booking Cancelled – Temporary Block Applied"
         body = (
             f"Hello {driver.first_name},\n\n"
             f"Your booking at {booking.garage.name} has been cancelled due to no confirmation.\n"
@@ -92,17 +128,96 @@ def expire_or_block_booking(booking_id: int) -> None:
             f"Thank you,\n"
             f"Parking System"
         )
-        send_mail(
-            subject,
-            body,
-            "Parking System <noreply@parking.com>",
-            [driver.email],
-            fail_silently=True,
+        messages.append(EmailMessage("Booking Cancelled – Temporary Block Applied", body, FROM_EMAIL, [driver.email]))
+    _send_emails(messages)
+
+    return len(bookings)
+
+
+def cancel_late_no_entry_bookings(queryset, now, batch_size=SWEEP_BATCH_SIZE) -> int:
+    """
+    Cancel late-confirmed bookings whose driver never entered. One hour is charged
+    from the wallet, or the driver is blocked when the balance doesn't cover it.
+    """
+    with transaction.atomic():
+        bookings = _lock_batch(queryset.filter(status="confirmed_late", start_time__isnull=True), batch_size)
+        if not bookings:
+            return 0
+
+        charged, blocked = [], []
+        for booking in bookings:
+            price_per_hour = booking.garage.price_per_hour
+            # Conditional decrement, so concurrent wallet updates are never lost
+            if User.objects.filter(
+                pk=booking.driver_id, wallet_balance__gte=price_per_hour
+            ).update(wallet_balance=F("wallet_balance") - price_per_hour):
+                charged.append(booking)
+            else:
+                blocked.append(booking)
+
+        User.objects.filter(id__in={b.driver_id for b in blocked}).update(blocked_until=now + LATE_NO_ENTRY_BLOCK)
+        Booking.objects.filter(id__in=[b.id for b in bookings]).update(status="cancelled")
+        ParkingSpot.objects.filter(id__in=[b.parking_spot_id for b in bookings]).transition("available")
+        for booking in bookings:
+            booking.status = "cancelled"
+            publish_booking_event(booking, "cancelled")
+
+    messages = []
+    for booking in charged:
+        body = (
+            f"Hello {booking.driver.first_name},\n\n"
+            f"Your booking at {booking.garage.name} has been cancelled because you did not enter within one hour of late confirmation.\n"
+            f"We have deducted the hourly fee of {booking.garage.price_per_hour} EGP from your wallet.\n\n"
+            f"Thank you,\n"
+            f"Parking System"
         )
-
-        print(
-            f"[expire_or_block_booking] booking {booking_id} expired, spot {spot.id} freed, user {driver.email} blocked for {block_hours} h"
+        messages.append(EmailMessage("Booking Cancelled – One Hour Charge Deducted", body, FROM_EMAIL, [booking.driver.email]))
+    for booking in blocked:
+        body = (
+            f"Hello {booking.driver.first_name},\n\n"
+            f"Your booking at {booking.garage.name} has been cancelled because you did not enter within one hour of late confirmation.\n"
+            f"You didn’t have enough balance in your wallet, so we’ve temporarily blocked your account from making new bookings for 24 hours.\n\n"
+            f"Thank you,\n"
+            f"Parking System"
         )
+        messages.append(EmailMessage("Booking Cancelled – You’ve Been Temporarily Blocked", body, FROM_EMAIL, [booking.driver.email]))
+    _send_emails(messages)
 
-    except Booking.DoesNotExist:
-        print(f"[expire_or_block_booking] booking {booking_id} not found")
+    return len(bookings)
+
+
+@shared_task
+def sweep_bookings() -> dict:
+    """
+    Periodic (Celery beat) replacement for the per-booking ETA tasks.
+    Every phase selects due rows through the (status, reservation_expiry_time)
+    index, is bounded by SWEEP_BATCH_SIZE and is safe to run again.
+    """
+    now = timezone.now()
+    result = {
+        "notified": notify_expired_bookings(
+            Booking.objects.filter(reservation_expiry_time__lte=now)
+        ),
+        "expired": expire_bookings(
+            Booking.objects.filter(reservation_expiry_time__lte=now - EXPIRY_RESPONSE_WINDOW), now
+        ),
+        "late_cancelled": cancel_late_no_entry_bookings(
+            Booking.objects.filter(confirmed_late_at__lte=now - LATE_ENTRY_WINDOW), now
+        ),
+    }
+    if any(result.values()):
+        print(f"[sweep_bookings] {result}")
+    return result
+
+
+@shared_task
+def expire_or_block_booking(booking_id: int) -> None:
+    """Expire a single booking right away (driver chose to cancel after the grace period)."""
+    now = timezone.now()
+    expire_bookings(Booking.objects.filter(id=booking_id, reservation_expiry_time__lte=now), now)
+
+
+@shared_task
+def notify_before_expiry(booking_id: int) -> None:
+    # No longer scheduled; kept so ETA tasks queued before the sweeper still run
+    notify_expired_bookings(Booking.objects.filter(id=booking_id, reservation_expiry_time__lte=timezone.now()))
@@ -1,3 +1,312 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import qrcode
+from django.core import mail
+from django.core.signing import BadSignature, SignatureExpired
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from accounts.models import CustomUser
+from booking.models import Booking
+from booking.tasks import sweep_bookings
+from booking.utils import make_qr_token, read_qr_token, send_booking_confirmation_email
+from garage.models import Garage
+from garage.tests import make_garage, make_owner
+
+
+def make_driver(n):
+    return CustomUser.objects.create_user(
+        email=f"driver{n}@example.com",
+        password=None,
+        username=f"driver{n}",
+        phone=f"0110000{n:04d}",
+        national_id=f"{n + 50000:014d}",
+        role='driver',
+    )
+
+
+@mock.patch('booking.views.queue_booking_confirmation')
+class BookingInitiateConcurrencyTests(TransactionTestCase):
+    drivers_count = 200
+
+    def setUp(self):
+        self.garage = make_garage(make_owner(), spots=1)
+        self.spot = self.garage.spots.get()
+        self.drivers = [make_driver(i) for i in range(self.drivers_count)]
+
+    def test_parallel_initiates_have_exactly_one_winner(self, queue_confirmation, *mocks):
+        barrier = threading.Barrier(self.drivers_count)
+        results = []
+
+        def initiate(driver):
+            client = APIClient()
+            client.force_authenticate(driver)
+            try:
+                barrier.wait()
+                response = client.post('/api/bookings/initiate/', {
+                    'garage_id': self.garage.id,
+                    'parking_spot_id': self.spot.id,
+                }, format='json')
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=initiate, args=(driver,)) for driver in self.drivers]
+        # Losers are logged as bad requests / conflicts
+        with self.assertLogs('django.request', level='WARNING'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(results), self.drivers_count)
+        self.assertNotIn(500, results)
+        self.assertEqual(results.count(201), 1)
+        self.assertEqual(Booking.objects.filter(parking_spot=self.spot).count(), 1)
+        queue_confirmation.assert_called_once()
+
+        self.spot.refresh_from_db()
+        self.assertEqual(self.spot.status, 'reserved')
+        garage = Garage.objects.get(pk=self.garage.pk)
+        self.assertEqual((garage.available_spots_count, garage.reserved_spots_count), (0, 1))
+
+
+@mock.patch('booking.views.queue_booking_confirmation')
+class BookingInitiateViewTests(TestCase):
+    def setUp(self):
+        self.garage = make_garage(make_owner(), spots=2)
+        self.spot = self.garage.spots.first()
+        self.client = APIClient()
+        self.client.force_authenticate(make_driver(1))
+
+    def test_confirmation_is_queued_after_commit(self, queue_confirmation, *mocks):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post('/api/bookings/initiate/', {
+                'garage_id': self.garage.id,
+                'parking_spot_id': self.spot.id,
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        # Confirmation email, plus the spot and booking dashboard events
+        self.assertEqual(len(callbacks), 3)
+        queue_confirmation.assert_called_once_with(response.data['booking_id'])
+        self.assertTrue(response.data['qr_code_url'].endswith(f"/api/bookings/{response.data['booking_id']}/qr.png"))
+
+
+def bearer(user):
+    return {'HTTP_AUTHORIZATION': f"Bearer {RefreshToken.for_user(user).access_token}"}
+
+
+class BookingQRCodeViewTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        garage = make_garage(self.owner, spots=1)
+        self.driver = make_driver(1)
+        self.booking = Booking.objects.create(
+            driver=self.driver,
+            garage=garage,
+            parking_spot=garage.spots.get(),
+            reservation_expiry_time=timezone.now() + timedelta(minutes=15),
+        )
+        self.url = f'/api/bookings/{self.booking.id}/qr.png'
+        self.client.defaults.update(bearer(self.driver))
+
+    def test_renders_png_with_validators(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+        self.booking.refresh_from_db()
+        self.assertFalse(self.booking.qr_code_image)
+
+    def test_accepts_image_png_only_clients(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+    def test_if_none_match_skips_rendering(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch('booking.views.booking_qr_png') as render:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+    def test_unknown_booking(self):
+        self.assertEqual(self.client.get('/api/bookings/999/qr.png').status_code, 404)
+
+    def test_only_driver_and_garage_owner(self):
+        self.assertEqual(self.client.get(self.url, **bearer(self.owner)).status_code, 200)
+        with self.assertLogs('booking.views', level='WARNING'):
+            self.assertEqual(self.client.get(self.url, **bearer(make_driver(2))).status_code, 403)
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION="Bearer nonsense").status_code, 401)
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_confirmation_email_embeds_qr(self):
+        send_booking_confirmation_email(self.booking)
+
+        message = mail.outbox[0].message()
+        self.assertIn('cid:booking-qr', mail.outbox[0].body)
+        images = [part for part in message.walk() if part.get_content_type() == 'image/png']
+        self.assertEqual(images[0]['Content-ID'], '<booking-qr>')
+
+
+class QRTokenTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        garage = make_garage(self.owner, spots=1)
+        self.booking = Booking.objects.create(
+            driver=make_driver(1),
+            garage=garage,
+            parking_spot=garage.spots.get(),
+            reservation_expiry_time=timezone.now() + timedelta(minutes=15),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_round_trip(self):
+        token = make_qr_token(self.booking)
+        self.assertEqual(read_qr_token(token), (self.booking.id, self.booking.garage_id))
+        self.assertEqual(read_qr_token(token.lower()), (self.booking.id, self.booking.garage_id))
+
+    def test_token_fits_small_qr(self):
+        qr = qrcode.QRCode()
+        qr.add_data(make_qr_token(self.booking))
+        qr.make(fit=True)
+        self.assertLessEqual(qr.version, 2)
+
+    def test_tampered_token_rejected(self):
+        token = make_qr_token(self.booking)
+        forged = token[:5] + ('A' if token[5] != 'A' else 'B') + token[6:]
+        with self.assertRaises(BadSignature):
+            read_qr_token(forged)
+        with self.assertRaises(BadSignature):
+            read_qr_token('not-a-token')
+
+    def test_expired_token_rejected(self):
+        self.booking.reservation_expiry_time = timezone.now() - timedelta(days=30)
+        token = make_qr_token(self.booking)
+        with self.assertRaises(SignatureExpired):
+            read_qr_token(token)
+        self.assertEqual(read_qr_token(token, for_exit=True), (self.booking.id, self.booking.garage_id))
+
+        self.booking.reservation_expiry_time = timezone.now() - timedelta(days=60)
+        with self.assertRaises(SignatureExpired):
+            read_qr_token(make_qr_token(self.booking), for_exit=True)
+
+    def test_scan_rejects_expired_token_without_queries(self):
+        Booking.objects.filter(pk=self.booking.pk).update(status='confirmed', start_time=timezone.now())
+        self.booking.reservation_expiry_time = timezone.now() - timedelta(days=60)
+        token = make_qr_token(self.booking)
+        with self.assertLogs('booking.views', level='WARNING'), self.assertNumQueries(0):
+            response = self.client.post('/api/bookings/scanner/', {'token': token}, format='json')
+        self.assertEqual(response.data['error'], "QR code has expired.")
+
+    def test_scan_rejects_forged_token_without_queries(self):
+        token = make_qr_token(self.booking)
+        with self.assertLogs('booking.views', level='WARNING'), self.assertNumQueries(0):
+            response = self.client.post('/api/bookings/scanner/', {'token': token[::-1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_scan_rejects_other_garage_without_queries(self):
+        token = make_qr_token(self.booking)
+        with self.assertLogs('booking.views', level='WARNING'), self.assertNumQueries(0):
+            response = self.client.post('/api/bookings/scanner/', {
+                'token': token, 'garage_id': self.booking.garage_id + 1,
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_scan_records_entry(self):
+        response = self.client.post('/api/bookings/scanner/', {'token': make_qr_token(self.booking)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['action'], 'entry')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertEqual(self.booking.parking_spot.status, 'occupied')
+
+
+    def test_expired_token_still_scans_out(self):
+        self.booking.reservation_expiry_time = timezone.now() - timedelta(days=30)
+        self.booking.status = 'pending'
+        self.booking.save()
+        token = make_qr_token(self.booking)
+
+        with self.assertLogs('booking.views', level='WARNING'):
+            response = self.client.post('/api/bookings/scanner/', {'token': token}, format='json')
+        self.assertEqual(response.data['error'], "QR code has expired.")
+
+        Booking.objects.filter(pk=self.booking.pk).update(
+            status='confirmed', start_time=timezone.now() - timedelta(days=5)
+        )
+        response = self.client.post('/api/bookings/scanner/', {'token': token}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['action'], 'exit')
+
+
+class BookingSweepTests(TestCase):
+    def setUp(self):
+        self.garage = make_garage(make_owner(), spots=3, price_per_hour=10)
+        self.driver = make_driver(1)
+
+    def book(self, spot, expiry_delta, **kwargs):
+        spot.change_status('reserved')
+        return Booking.objects.create(
+            driver=self.driver,
+            garage=self.garage,
+            parking_spot=spot,
+            reservation_expiry_time=timezone.now() + expiry_delta,
+            **kwargs
+        )
+
+    def test_notify_then_expire(self):
+        spots = list(self.garage.spots.order_by('id'))
+        due = self.book(spots[0], timedelta(seconds=-10))
+        overdue = self.book(spots[1], timedelta(minutes=-5), status='awaiting_response', late_alert_sent=True)
+        future = self.book(spots[2], timedelta(minutes=10))
+
+        self.assertEqual(sweep_bookings(), {'notified': 1, 'expired': 1, 'late_cancelled': 0})
+        self.assertEqual(len(mail.outbox), 2)
+
+        due.refresh_from_db()
+        overdue.refresh_from_db()
+        future.refresh_from_db()
+        self.assertEqual((due.status, due.late_alert_sent), ('awaiting_response', True))
+        self.assertEqual(overdue.status, 'expired')
+        self.assertEqual(future.status, 'pending')
+        self.assertEqual(overdue.parking_spot.status, 'available')
+        self.garage.refresh_from_db()
+        self.assertEqual((self.garage.available_spots_count, self.garage.reserved_spots_count), (1, 2))
+        self.driver.refresh_from_db()
+        self.assertGreater(self.driver.blocked_until, timezone.now())
+
+        # Nothing left to do until more bookings come due
+        self.assertEqual(sweep_bookings(), {'notified': 0, 'expired': 0, 'late_cancelled': 0})
+
+    def test_late_confirmation_without_entry(self):
+        self.driver.wallet_balance = 25
+        self.driver.save(update_fields=['wallet_balance'])
+        booking = self.book(
+            self.garage.spots.first(), timedelta(hours=-2),
+            status='confirmed_late', confirmed_late_at=timezone.now() - timedelta(minutes=61),
+        )
+
+        self.assertEqual(sweep_bookings()['late_cancelled'], 1)
+
+        booking.refresh_from_db()
+        self.driver.refresh_from_db()
+        self.assertEqual(booking.status, 'cancelled')
+        self.assertEqual(booking.parking_spot.status, 'available')
+        self.assertEqual(self.driver.wallet_balance, 15)
+        self.assertIsNone(self.driver.blocked_until)
@@ -6,11 +6,13 @@ from booking.views import (
     CancelBookingView,
     scan_qr_code,
     BookingLateDecisionView,
+    booking_qr_code,
 )
 
 urlpatterns = [
     path('initiate/', BookingInitiateView.as_view(), name='booking-initiate'),
     path('<int:id>/', BookingDetailView.as_view(), name='booking-detail'),
+    path('<int:id>/qr.png', booking_qr_code, name='booking-qr'),
     path('<int:id>/late-decision/', BookingLateDecisionView.as_view(), name='booking-late-decision'),
     path('cancel/<int:booking_id>/', CancelBookingView.as_view(), name='booking-cancel'),
     path('active/', ActiveBookingView.as_view(), name='booking-active'),
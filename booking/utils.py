@@ -1,47 +1,133 @@
 import qrcode
-import json
+import base64
+import binascii
+import hashlib
+import struct
+import time
+from datetime import datetime, timedelta
 from io import BytesIO
-from django.core.files.base import ContentFile
+from email.mime.image import MIMEImage
+from django.core.cache import cache
 from django.core.mail import EmailMessage
+from django.core.signing import BadSignature, SignatureExpired
+from django.utils.crypto import constant_time_compare, salted_hmac
 from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
 from django.conf import settings  # ✅ لازم تضيف ده فوق
 
+# Rendered QR PNGs are kept in the Django cache instead of MEDIA_ROOT
+QR_CACHE_TIMEOUT = 60 * 60 * 24
+QR_CACHE_KEY = "booking_qr:{}"
+
+# QR token = base32(booking id | garage id | expiry | truncated HMAC-SHA256).
+# Base32 stays inside the QR alphanumeric charset, so the code fits in version 2.
+QR_TOKEN_SALT = "booking.utils.qr_token"
+QR_TOKEN_BODY = struct.Struct(">III")
+QR_TOKEN_MAC_BYTES = 10
+# How long past the reservation expiry a code still scans
+QR_TOKEN_VALIDITY = timedelta(hours=getattr(settings, "BOOKING_QR_TOKEN_VALIDITY_HOURS", 72))
+# Past that, the code only lets a parked car (status "confirmed") out, for this much longer.
+# Fixed rather than stored in the token, so gates still reject older codes offline
+QR_EXIT_GRACE = timedelta(days=getattr(settings, "BOOKING_QR_EXIT_GRACE_DAYS", 30))
+
+
+def local_day_range(day=None):
+    """
+    Aware [start, end) datetimes of a local calendar day (today by default).
+    Filter with __gte/__lt on these instead of __date so the column indexes stay usable.
+    """
+    day = day or timezone.localdate()
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, start + timedelta(days=1)
+
+
+def booking_qr_url(booking):
+    """URL of the on-demand QR endpoint. The PNG is rendered on first fetch."""
+    return reverse("booking-qr", args=[booking.id])
+
+
+def _qr_token_mac(body):
+    return salted_hmac(QR_TOKEN_SALT, body, algorithm="sha256").digest()[:QR_TOKEN_MAC_BYTES]
+
+
+def make_qr_token(booking):
+    expires = int((booking.reservation_expiry_time + QR_TOKEN_VALIDITY).timestamp())
+    body = QR_TOKEN_BODY.pack(booking.id, booking.garage_id, expires)
+    return base64.b32encode(body + _qr_token_mac(body)).decode("ascii").rstrip("=")
 
-def generate_qr_code_for_booking(booking):
-    data = {
-        "id": booking.id,
-        "garage_name": booking.garage.name,
-        "spot_id": booking.parking_spot.id,
-        "estimated_arrival_time": booking.estimated_arrival_time.isoformat() if booking.estimated_arrival_time else None,
-        "reservation_expiry_time": booking.reservation_expiry_time.isoformat(),
-        "estimated_cost": float(booking.estimated_cost),
-        "status": booking.status,
-    }
 
-    qr_data = json.dumps(data, indent=2)
+def read_qr_token(token, for_exit=False):
+    """
+    Verify a QR token without touching the database.
+    Returns (booking_id, garage_id); raises BadSignature or SignatureExpired.
+    for_exit=True also accepts a code up to QR_EXIT_GRACE past its expiry.
+    """
+    token = (token or "").strip().upper()
+    try:
+        raw = base64.b32decode(token + "=" * (-len(token) % 8))
+    except (binascii.Error, ValueError):
+        raise BadSignature("Malformed QR token.")
+    if len(raw) != QR_TOKEN_BODY.size + QR_TOKEN_MAC_BYTES:
+        raise BadSignature("Malformed QR token.")
 
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_data)
+    body, mac = raw[:QR_TOKEN_BODY.size], raw[QR_TOKEN_BODY.size:]
+    if not constant_time_compare(mac, _qr_token_mac(body)):
+        raise BadSignature("QR token signature does not match.")
+
+    booking_id, garage_id, expires = QR_TOKEN_BODY.unpack(body)
+    if for_exit:
+        expires += int(QR_EXIT_GRACE.total_seconds())
+    if time.time() > expires:
+        raise SignatureExpired("QR token has expired.")
+    return booking_id, garage_id
+
+
+def qr_payload(booking):
+    """What gets encoded into the booking QR: the signed token, nothing else."""
+    return make_qr_token(booking)
+
+
+def qr_etag(payload):
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def render_qr_png(data):
+    qr = qrcode.QRCode(box_size=10, border=4)
+    qr.add_data(data)
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white")
 
     buffer = BytesIO()
     img.save(buffer, format='PNG')
-    file_content = ContentFile(buffer.getvalue())
+    return buffer.getvalue()
+
 
-    filename = f"booking_{booking.id}.png"
-    booking.qr_code_image.save(filename, file_content)
-    booking.save()
+def booking_qr_png(booking):
+    """
+    Return (etag, png_bytes) for the booking QR.
+    The PNG is rendered at most once per payload and then served from the cache.
+    """
+    payload = qr_payload(booking)
+    etag = qr_etag(payload)
+    key = QR_CACHE_KEY.format(booking.id)
 
-    return booking.qr_code_image.url
+    cached = cache.get(key)
+    if cached and cached[0] == etag:
+        return cached
+
+    png = render_qr_png(payload)
+    cache.set(key, (etag, png), QR_CACHE_TIMEOUT)
+    return etag, png
 
 
 def send_booking_confirmation_email(booking):
     subject = f"Booking Confirmation - Booking #{booking.id}"
-    
+
     context = {
         "booking": booking,
-        "qr_code_url": booking.qr_code_image.url,
+        # Inline attachment below
+        "qr_code_url": "cid:booking-qr",
     }
 
     body = render_to_string("emails/booking_confirmation.html", context)
@@ -53,9 +139,13 @@ def send_booking_confirmation_email(booking):
         to=[booking.driver.email],
         reply_to=[booking.driver.email],
     )
-    email.content_subtype = "html"  
+    email.content_subtype = "html"
+    email.mixed_subtype = "related"
 
-    if booking.qr_code_image:
-        email.attach_file(booking.qr_code_image.path)
+    _, png = booking_qr_png(booking)
+    image = MIMEImage(png, "png")
+    image.add_header("Content-ID", "<booking-qr>")
+    image.add_header("Content-Disposition", "inline", filename=f"booking_{booking.id}.png")
+    email.attach(image)
 
     email.send()
@@ -2,19 +2,27 @@ from datetime import timedelta
 from decimal import Decimal
 import logging
 
+from django.db import transaction
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.contrib.auth import get_user_model
+from django.core.signing import BadSignature, SignatureExpired
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.generics import RetrieveAPIView
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
-from booking.tasks_late import handle_late_confirmation_no_entry
-from booking.models import Booking
+from booking.models import ACTIVE_BOOKING_STATUSES, Booking
 from booking.serializers import BookingInitiationSerializer, BookingDetailSerializer
-from booking.tasks import expire_or_block_booking, notify_before_expiry
-from booking.utils import generate_qr_code_for_booking, send_booking_confirmation_email
+from booking.tasks import expire_or_block_booking, queue_booking_confirmation
+from booking.utils import booking_qr_url, booking_qr_png, qr_etag, qr_payload, read_qr_token
+from garage.events import publish_booking_event
 from garage.models import ParkingSpot
 
 logger = logging.getLogger(__name__)
@@ -58,7 +66,7 @@ class BookingInitiateView(APIView):
         # Check if user already has any active booking
         if Booking.objects.filter(
             driver=user,
-            status__in=["pending", "confirmed", "confirmed_late", "awaiting_response"],
+            status__in=ACTIVE_BOOKING_STATUSES,
             reservation_expiry_time__gt=timezone.now(),
         ).exists():
             return Response({"error": "لديك حجز قائم بالفعل."}, status=400)
@@ -67,7 +75,7 @@ class BookingInitiateView(APIView):
         if Booking.objects.filter(
             driver=user,
             parking_spot=spot,
-            status__in=["pending", "confirmed", "confirmed_late", "awaiting_response"],
+            status__in=ACTIVE_BOOKING_STATUSES,
             reservation_expiry_time__gt=timezone.now(),
         ).exists():
             return Response({"error": "لقد قمت بالفعل بحجز هذا المكان مسبقًا."}, status=400)
@@ -76,42 +84,42 @@ class BookingInitiateView(APIView):
         if user.wallet_balance < estimated_fee:
             return Response({"error": "رصيد المحفظة غير كافٍ."}, status=400)
 
-        # Reserve the spot
-        spot.status = "reserved"
-        spot.save()
-
-        # Deduct wallet
-        # user.wallet_balance -= estimated_fee
-        # user.save(update_fields=["wallet_balance"])
-
-        # Create booking
-        now = timezone.now()
-        expiry = now + timedelta(minutes=grace)
+        with transaction.atomic():
+            # Lock the spot row, then reserve it with a conditional
+            # UPDATE ... WHERE status='available' so only one driver can win it
+            spot = ParkingSpot.objects.select_for_update().get(pk=spot.pk)
+            if not spot.change_status("reserved", expected="available"):
+                return Response({"error": "This parking spot is currently unavailable."}, status=409)
+
+            # Deduct wallet
+            # user.wallet_balance -= estimated_fee
+            # user.save(update_fields=["wallet_balance"])
+
+            # Create booking
+            now = timezone.now()
+            expiry = now + timedelta(minutes=grace)
+
+            booking = Booking.objects.create(
+                driver=user,
+                garage=garage,
+                parking_spot=spot,
+                estimated_cost=estimated_fee,
+                reservation_expiry_time=expiry,
+                status="pending",
+            )
 
-        booking = Booking.objects.create(
-            driver=user,
-            garage=garage,
-            parking_spot=spot,
-            estimated_cost=estimated_fee,
-            reservation_expiry_time=expiry,
-            status="pending",
-        )
+            # The confirmation email is sent from Celery once the booking is committed
+            transaction.on_commit(lambda: queue_booking_confirmation(booking.id), robust=True)
+            publish_booking_event(booking, "initiated")
 
-        # Generate QR and send email
-        generate_qr_code_for_booking(booking)
-        send_booking_confirmation_email(booking)
-
-        # Schedule background tasks
-        notify_before_expiry.apply_async((booking.id,), eta=booking.reservation_expiry_time)
-        expire_or_block_booking.apply_async(
-            (booking.id,), eta=booking.reservation_expiry_time + timedelta(minutes=1)
-        )
+        # Expiry and the "time is up" notice are handled by the periodic sweep_bookings task
 
         return Response({
             "booking_id": booking.id,
             "estimated_cost": float(estimated_fee),
             "reservation_expiry_time": booking.reservation_expiry_time.isoformat(),
-            "qr_code_url": booking.qr_code_image.url if booking.qr_code_image else None,
+            # Rendered lazily on first fetch
+            "qr_code_url": request.build_absolute_uri(booking_qr_url(booking)),
             "wallet_balance": float(user.wallet_balance),
         }, status=201)
 
@@ -122,6 +130,44 @@ class BookingDetailView(RetrieveAPIView):
     lookup_url_kwarg = "id"
 
 
+class PNGRenderer(BaseRenderer):
+    """Lets clients that only accept image/png through content negotiation; errors still render as JSON."""
+    media_type = "image/png"
+    format = "png"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data if isinstance(data, bytes) else JSONRenderer().render(data)
+
+
+@api_view(["GET"])
+@renderer_classes([JSONRenderer, PNGRenderer])
+@permission_classes([IsAuthenticated])
+def booking_qr_code(request, id):
+    booking = get_object_or_404(
+        Booking.objects.select_related("garage").only(
+            "id", "driver_id", "garage_id", "garage__owner_id", "reservation_expiry_time"
+        ),
+        id=id,
+    )
+    # The code holds a valid scan token: only the driver and the garage owner get it
+    if request.user.id not in (booking.driver_id, booking.garage.owner_id):
+        logger.warning(f"Unauthorized QR fetch by user {request.user.id} for booking {booking.id}")
+        raise PermissionDenied("You are not authorized to view this QR code.")
+
+    # Cheap: hashes the payload without rendering, so If-None-Match hits skip the PNG entirely
+    etag = quote_etag(qr_etag(qr_payload(booking)))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        _, png = booking_qr_png(booking)
+        response = HttpResponse(png, content_type="image/png")
+    response["ETag"] = etag
+    # The token changes on late confirmation, so clients revalidate (cheap 304) every time
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
 class ActiveBookingView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -154,11 +200,9 @@ class CancelBookingView(APIView):
             booking = Booking.objects.get(id=booking_id, driver=request.user)
         except Booking.DoesNotExist:
             return Response({"error": "Booking not found."}, status=404)
-        # Debug ## 
-        print("DEBUG: Booking Status =", booking.status)
-        print("DEBUG: Expiry Time =", booking.reservation_expiry_time)
-        print("DEBUG: Now =", timezone.now())
-        # ##
+        logger.debug(
+            f"Cancel request for booking {booking.id}: status={booking.status}, expiry={booking.reservation_expiry_time}"
+        )
         if booking.status != "pending":
             return Response({"error": "Can cancel only pending bookings."}, status=400)
 ##this part for expired bookings (cann't bokk new until i have un experied booking so comment this part temporarily)
@@ -168,9 +212,8 @@ class CancelBookingView(APIView):
         booking.status = "cancelled"
         booking.save(update_fields=["status"])
 
-        spot = booking.parking_spot
-        spot.status = "available"
-        spot.save(update_fields=["status"])
+        booking.parking_spot.change_status("available")
+        publish_booking_event(booking, "cancelled")
 
         return Response({"success": "Booking cancelled."})
 
@@ -200,9 +243,7 @@ class BookingLateDecisionView(APIView):
                 "status", "confirmed_late_at", "reservation_expiry_time", "late_alert_sent", "confirmation_time"
             ])
 
-            # Schedule task to check entry after 1 hour
-            from booking.tasks_late import handle_late_confirmation_no_entry
-            handle_late_confirmation_no_entry.apply_async((booking.id,), eta=now + timedelta(hours=1))
+            # sweep_bookings cancels it if the driver hasn't entered within the hour
 
             logger.info(
                 f"User {request.user.id} CONFIRMED late booking {booking.id} at {now.isoformat()}"
@@ -310,28 +351,46 @@ class BookingLateDecisionView(APIView):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def scan_qr_code(request):
-    booking_id = request.data.get("booking_id")
-    
-    # Enhanced logging
-    logger.info(f"QR scan request from user {request.user.id} for booking {booking_id}")
-    
-    # Validate booking_id is provided
-    if not booking_id:
-        logger.error("QR scan failed: Missing booking_id in request")
-        return Response({"error": "Missing booking_id in request."}, status=400)
-    
-    # Validate booking_id is an integer
+    token = request.data.get("token")
+
+    # Validate token is provided
+    if not token:
+        logger.error("QR scan failed: Missing token in request")
+        return Response({"error": "Missing QR token in request."}, status=400)
+
+    # Signature and expiry are checked before any database access
+    exit_only = False
     try:
-        booking_id = int(booking_id)
-    except (ValueError, TypeError):
-        logger.error(f"QR scan failed: Invalid booking ID format: {booking_id}")
-        return Response({"error": "Invalid booking ID format. Expected a number."}, status=400)
-    
+        booking_id, garage_id = read_qr_token(token)
+    except SignatureExpired:
+        try:
+            # Past its entry window a code still lets a parked car out (checked below)
+            booking_id, garage_id = read_qr_token(token, for_exit=True)
+        except SignatureExpired:
+            logger.warning(f"QR scan rejected: expired token from user {request.user.id}")
+            return Response({"error": "QR code has expired."}, status=400)
+        exit_only = True
+    except BadSignature:
+        logger.warning(f"QR scan rejected: invalid token from user {request.user.id}")
+        return Response({"error": "QR code is invalid."}, status=400)
+
+    logger.info(f"QR scan request from user {request.user.id} for booking {booking_id}")
+
+    # Gates may send the garage they are installed at
+    gate_garage_id = request.data.get("garage_id")
+    if gate_garage_id is not None and str(gate_garage_id) != str(garage_id):
+        logger.warning(f"QR scan rejected: booking {booking_id} belongs to garage {garage_id}, not {gate_garage_id}")
+        return Response({"error": "QR code belongs to a different garage."}, status=400)
+
     try:
-        booking = Booking.objects.select_related("parking_spot", "garage").get(id=booking_id)
+        booking = Booking.objects.select_related("parking_spot", "garage__owner", "driver").get(id=booking_id)
     except Booking.DoesNotExist:
         logger.error(f"Booking {booking_id} doesn't exist in DB")
         return Response({"error": "QR code is invalid - booking not found."}, status=404)
+
+    if exit_only and booking.status != "confirmed":
+        logger.warning(f"QR scan rejected: expired token from user {request.user.id}")
+        return Response({"error": "QR code has expired."}, status=400)
         
     # Check ownership
     # If the garage owner is scanning for their own garage, allow. If not, allow but handle wallet deduction below.
@@ -360,9 +419,8 @@ def scan_qr_code(request):
             booking.save(update_fields=["status", "start_time", "waiting_time", "confirmation_time"])
             logger.info(f"Entry recorded for booking {booking_id} at {now}")
 
-            spot = booking.parking_spot
-            spot.status = 'occupied'
-            spot.save()
+            booking.parking_spot.change_status("occupied")
+            publish_booking_event(booking, "entry")
 
             return Response({
                 "message": "Entry recorded successfully",
@@ -428,9 +486,8 @@ def scan_qr_code(request):
         # End Update Wallet  ####
         booking.save(update_fields=["status", "end_time", "actual_cost"])
 
-        spot = booking.parking_spot
-        spot.status = "available"
-        spot.save(update_fields=["status"])
+        booking.parking_spot.change_status("available")
+        publish_booking_event(booking, "exit", actual_cost=booking.actual_cost)
 
         logger.info(f"Exit recorded for booking {booking_id}: duration={duration}, cost={booking.actual_cost}")
 
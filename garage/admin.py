@@ -4,6 +4,8 @@ from .models import Garage, GarageReview, ParkingSpot
 
 class GarageAdmin(admin.ModelAdmin):
     list_display = ('name', 'address', 'price_per_hour', 'preview_image')
+    # Maintained by spot transitions, repaired with `manage.py reconcile_spot_counters`
+    readonly_fields = ('available_spots_count', 'reserved_spots_count', 'occupied_spots_count')
 
     def preview_image(self, obj):
         if obj.image:
@@ -1,6 +1,26 @@
+import logging
+
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_spot_counters(sender, using='default', **kwargs):
+    """
+    Garages that predate the occupancy counters start with all of them at 0:
+    recount them after every migrate, so a deploy never serves empty counters.
+    """
+    from .models import reconcile_spot_counters
+
+    drifted, checked = reconcile_spot_counters(using=using)
+    if drifted:
+        logger.info("Backfilled the spot counters of %d of %d garages", len(drifted), checked)
 
 
 class GarageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'garage'
+
+    def ready(self):
+        post_migrate.connect(backfill_spot_counters, sender=self)
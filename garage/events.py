@@ -0,0 +1,196 @@
+"""
+Pub/sub of live garage changes for owner dashboards.
+
+Spot transitions and booking lifecycle events are published per garage once the
+surrounding transaction commits; owner_dashboard.views.owner_event_stream relays
+them to the browser as Server-Sent Events.
+
+The default broker is in-process and only reaches streams served by the same
+process. Set OWNER_EVENTS_REDIS_URL to go through Redis pub/sub instead, so events
+published by Celery workers (expiry sweeps) and other ASGI workers arrive too.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "garage-events:{}"
+# Per owner: "garage.created", so open streams start following the new garage
+OWNER_CHANNEL = "owner-events:{}"
+# Events buffered per stream; a stream that falls further behind misses events
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def garage_channel(garage_id):
+    return CHANNEL.format(garage_id)
+
+
+def owner_channel(owner_id):
+    return OWNER_CHANNEL.format(owner_id)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # The stream's event loop is already closed
+                pass
+
+    def subscribe(self, channels):
+        return InProcessSubscription(self, channels)
+
+    def _add(self, channels, key):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(key)
+
+    def _remove(self, channels, key):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].discard(key)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        logger.warning("Dropping owner event for a slow stream")
+
+
+class InProcessSubscription:
+    """Must be created from inside the event loop that will read it."""
+
+    def __init__(self, broker, channels):
+        self._broker = broker
+        self._channels = list(channels)
+        self._queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._key = (asyncio.get_running_loop(), self._queue)
+        broker._add(self._channels, self._key)
+
+    async def get(self, timeout):
+        """Next message, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def add(self, channels):
+        channels = [channel for channel in channels if channel not in self._channels]
+        self._broker._add(channels, self._key)
+        self._channels.extend(channels)
+
+    async def close(self):
+        self._broker._remove(self._channels, self._key)
+
+
+class RedisBroker:
+    def __init__(self, url):
+        import redis
+
+        self._url = url
+        self._client = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        import redis
+
+        try:
+            self._client.publish(channel, message)
+        except redis.RedisError:
+            logger.exception("Could not publish owner event to %s", channel)
+
+    def subscribe(self, channels):
+        return RedisSubscription(self._url, channels)
+
+
+class RedisSubscription:
+    def __init__(self, url, channels):
+        import redis.asyncio
+
+        self._client = redis.asyncio.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._channels = list(channels)
+        self._subscribed = False
+
+    async def get(self, timeout):
+        if not self._channels:
+            await asyncio.sleep(timeout)
+            return None
+        if not self._subscribed:
+            await self._pubsub.subscribe(*self._channels)
+            self._subscribed = True
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        data = message["data"]
+        return data.decode() if isinstance(data, bytes) else data
+
+    async def add(self, channels):
+        channels = [channel for channel in channels if channel not in self._channels]
+        self._channels.extend(channels)
+        if self._subscribed and channels:
+            await self._pubsub.subscribe(*channels)
+
+    async def close(self):
+        await self._pubsub.aclose()
+        await self._client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, "OWNER_EVENTS_REDIS_URL", None)
+                _broker = RedisBroker(url) if url else InProcessBroker()
+    return _broker
+
+
+def _publish_on_commit(channel, data):
+    message = json.dumps({**data, "at": timezone.now().isoformat()}, default=str)
+    transaction.on_commit(lambda: get_broker().publish(channel, message), robust=True)
+
+
+def publish_garage_event(garage_id, event_type, **data):
+    """
+    Publish an event to the garage's dashboard streams after the current transaction
+    commits (immediately when not in one), so rolled back changes are never announced.
+    """
+    _publish_on_commit(garage_channel(garage_id), {"type": event_type, "garage_id": garage_id, **data})
+
+
+def publish_owner_event(owner_id, event_type, **data):
+    """Same, on the owner's channel (events about the set of garages itself)."""
+    _publish_on_commit(owner_channel(owner_id), {"type": event_type, **data})
+
+
+def publish_booking_event(booking, action, **data):
+    """Booking lifecycle event (initiated, entry, exit, expired, cancelled) on the booking's garage."""
+    publish_garage_event(
+        booking.garage_id,
+        f"booking.{action}",
+        booking_id=booking.id,
+        spot_id=booking.parking_spot_id,
+        status=booking.status,
+        **data
+    )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from garage.models import reconcile_spot_counters
+
+
+class Command(BaseCommand):
+    help = "Recount ParkingSpot statuses and repair drifted Garage occupancy counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted garages.")
+
+    def handle(self, *args, **options):
+        drifted, checked = reconcile_spot_counters(dry_run=options['dry_run'])
+        for garage, stale in drifted:
+            self.stdout.write(
+                f"Garage {garage.id} ({garage.name}): "
+                + ", ".join(f"{field} {old} -> {getattr(garage, field)}" for field, old in stale.items())
+            )
+
+        verb = "Found" if options['dry_run'] else "Repaired"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drifted)} of {checked} garages with drifted counters."))
@@ -1,7 +1,30 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
-from django.db.models import Avg
+from django.db.models import Avg, F
 from accounts.models import CustomUser 
+from .events import publish_garage_event, publish_owner_event
+
+SLOT_PREFIX = "SLOT"
+# bulk_create caps this further at the backend's query parameter limit
+SPOT_BULK_BATCH_SIZE = 1000
+
+# ParkingSpot.status -> Garage counter column that tracks it
+SPOT_COUNTER_FIELDS = {
+    'available': 'available_spots_count',
+    'reserved': 'reserved_spots_count',
+    'occupied': 'occupied_spots_count',
+}
+
+
+def spot_counter_deltas(from_status, to_status, n=1):
+    """F() expressions that move n spots from one Garage counter to another."""
+    return {
+        SPOT_COUNTER_FIELDS[from_status]: F(SPOT_COUNTER_FIELDS[from_status]) - n,
+        SPOT_COUNTER_FIELDS[to_status]: F(SPOT_COUNTER_FIELDS[to_status]) + n,
+    }
+
 class Garage(models.Model):
     ##############Mandatory to know garage owner ###################
     owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='owned_garages', limit_choices_to={'role': 'garage_owner'})
@@ -44,7 +67,18 @@ class Garage(models.Model):
         help_text="عدد ساعات الحظر عند الإلغاء المتأخر"
     )
 
+    # Live occupancy counters, kept in sync by every ParkingSpot status transition.
+    # Recounted after every migrate (backfills existing garages, see apps.py);
+    # run `manage.py reconcile_spot_counters` to repair drift in between.
+    available_spots_count = models.IntegerField(default=0)
+    reserved_spots_count = models.IntegerField(default=0)
+    occupied_spots_count = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Serves the bounding-box filter of the nearby search
+            models.Index(fields=['verification_status', 'latitude', 'longitude'], name='garage_verified_geo_idx'),
+        ]
 
     def clean(self):
         if not (22 <= self.latitude <= 32):
@@ -66,6 +100,54 @@ class Garage(models.Model):
    
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # Open dashboard streams of the owner start following it (bulk_create skips this)
+            publish_owner_event(self.owner_id, "garage.created", garage_id=self.pk)
+
+    @property
+    def total_spots_count(self):
+        return self.available_spots_count + self.reserved_spots_count + self.occupied_spots_count
+
+    def adjust_available_spots(self, delta):
+        """Add delta (may be negative) to the available counter after spots are created or deleted."""
+        if delta:
+            Garage.objects.filter(pk=self.pk).update(available_spots_count=F('available_spots_count') + delta)
+            self.available_spots_count += delta
+
+    def add_spots(self, count):
+        """
+        Create `count` available spots in bulk. Slot numbers continue after the
+        highest existing SLOT-<n>, so they never collide with spots that survived a resize.
+        """
+        if count <= 0:
+            return []
+        last = 0
+        for slot_number in self.spots.values_list('slot_number', flat=True):
+            prefix, _, number = slot_number.rpartition('-')
+            if prefix == SLOT_PREFIX and number.isdigit():
+                last = max(last, int(number))
+        spots = ParkingSpot.objects.bulk_create(
+            (ParkingSpot(garage=self, slot_number=f"{SLOT_PREFIX}-{n:03d}") for n in range(last + 1, last + count + 1)),
+            batch_size=SPOT_BULK_BATCH_SIZE,
+        )
+        self.adjust_available_spots(count)
+        return spots
+
+    def remove_available_spots(self, count):
+        """
+        Delete up to `count` available spots (newest first) with one queryset delete.
+        Reserved and occupied spots are never touched. Returns how many were removed.
+        """
+        if count <= 0:
+            return 0
+        ids = list(self.spots.filter(status='available').order_by('-id').values_list('id', flat=True)[:count])
+        ParkingSpot.objects.filter(id__in=ids).delete()
+        self.adjust_available_spots(-len(ids))
+        return len(ids)
 # New model for garage verification requests
 class GarageVerificationRequest(models.Model):
     STATUS_CHOICES = (
@@ -109,6 +191,40 @@ class GarageReview(models.Model):
     def __str__(self):
         return f"{self.driver} - {self.rating}"
 
+class ParkingSpotQuerySet(models.QuerySet):
+    def transition(self, to_status):
+        """
+        Move every spot in this queryset to `to_status` and update the owning
+        garages' counters in the same transaction.
+        Returns the ids of the spots that actually changed.
+        """
+        groups = defaultdict(list)
+        changed_ids = []
+        with transaction.atomic():
+            rows = self.exclude(status=to_status).select_for_update().values_list('id', 'garage_id', 'status')
+            for spot_id, garage_id, from_status in rows:
+                groups[(garage_id, from_status)].append(spot_id)
+
+            deltas = defaultdict(lambda: defaultdict(int))
+            for (garage_id, from_status), ids in groups.items():
+                updated = ParkingSpot.objects.filter(id__in=ids, status=from_status).update(status=to_status)
+                if not updated:
+                    continue
+                if updated != len(ids):
+                    # Some rows moved under us (no row locks on this backend)
+                    ids = list(ParkingSpot.objects.filter(id__in=ids, status=to_status).values_list('id', flat=True))
+                changed_ids.extend(ids)
+                publish_garage_event(garage_id, "spots", spot_ids=ids, status=to_status, previous=from_status)
+                deltas[garage_id][SPOT_COUNTER_FIELDS[from_status]] -= updated
+                deltas[garage_id][SPOT_COUNTER_FIELDS[to_status]] += updated
+
+            for garage_id, fields in deltas.items():
+                Garage.objects.filter(pk=garage_id).update(
+                    **{field: F(field) + delta for field, delta in fields.items() if delta}
+                )
+        return changed_ids
+
+
 class ParkingSpot(models.Model):
     STATUS_CHOICES = [
     ('available', 'Available'),
@@ -118,5 +234,66 @@ class ParkingSpot(models.Model):
     garage = models.ForeignKey(Garage, on_delete=models.CASCADE, related_name='spots')
     slot_number = models.CharField(max_length=10)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='available')
+
+    objects = ParkingSpotQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Picks spots of a given status in a garage, in id order, without a sort
+            models.Index(fields=['garage', 'status', 'id'], name='spot_garage_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.garage.name} - Spot {self.slot_number}"
+
+    def change_status(self, new_status, expected=None):
+        """
+        Compare-and-swap the spot from `expected` (default: the status loaded on
+        this instance) to `new_status`, keeping the garage counters in sync.
+        Returns False if the spot was not in the expected status.
+        """
+        expected = expected or self.status
+        if new_status == expected:
+            return ParkingSpot.objects.filter(pk=self.pk, status=expected).exists()
+
+        with transaction.atomic():
+            updated = ParkingSpot.objects.filter(pk=self.pk, status=expected).update(status=new_status)
+            if updated:
+                Garage.objects.filter(pk=self.garage_id).update(**spot_counter_deltas(expected, new_status))
+                publish_garage_event(self.garage_id, "spots", spot_ids=[self.pk], status=new_status, previous=expected)
+        if updated:
+            self.status = new_status
+        return bool(updated)
+
+
+def reconcile_spot_counters(dry_run=False, using='default'):
+    """
+    Recount ParkingSpot statuses and write the result to drifted Garage counters.
+    Returns ([(garage, {field: stale value})] for the drifted garages, number of garages checked).
+    """
+    fields = list(SPOT_COUNTER_FIELDS.values())
+
+    with transaction.atomic(using=using):
+        # Lock the counters first so transitions can't race the recount
+        garages = list(Garage.objects.using(using).select_for_update().only('id', 'name', *fields))
+
+        actual = defaultdict(lambda: dict.fromkeys(fields, 0))
+        rows = ParkingSpot.objects.using(using).values('garage_id', 'status').annotate(n=models.Count('id'))
+        for row in rows:
+            field = SPOT_COUNTER_FIELDS.get(row['status'])
+            if field:
+                actual[row['garage_id']][field] = row['n']
+
+        drifted = []
+        for garage in garages:
+            expected = actual[garage.id]
+            stale = {field: getattr(garage, field) for field in fields if getattr(garage, field) != expected[field]}
+            if stale:
+                for field in fields:
+                    setattr(garage, field, expected[field])
+                drifted.append((garage, stale))
+
+        if drifted and not dry_run:
+            Garage.objects.using(using).bulk_update([garage for garage, _ in drifted], fields, batch_size=500)
+
+    return drifted, len(garages)
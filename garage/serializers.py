@@ -1,6 +1,7 @@
 from rest_framework import serializers
+from django.db import transaction
 from .models import Garage, GarageReview, GarageVerificationRequest, ParkingSpot
-from geopy.distance import geodesic
+from .utils import haversine_km
 
 class GarageDetailSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
@@ -38,19 +39,21 @@ class GarageSerializer(serializers.ModelSerializer):
                   'price_per_hour', 'distance', 'available_spots', 'verification_status']
 
     def get_distance(self, obj):
+        # Precomputed by nearby_garages()
+        distance = getattr(obj, 'distance', None)
+        if distance is not None:
+            return round(distance, 2)
+
         request = self.context.get('request')
         if request:
             lat = request.query_params.get('lat')
             lon = request.query_params.get('lon')
             if lat and lon:
-                return round(geodesic(
-                    (float(lat), float(lon)),
-                    (obj.latitude, obj.longitude)
-                ).km, 2)
+                return round(float(haversine_km(float(lat), float(lon), obj.latitude, obj.longitude)), 2)
         return None
 
     def get_available_spots(self, obj):
-        return obj.spots.filter(status='available').count()
+        return obj.available_spots_count
 
 ##########  grage registration serializer ##########
 class GarageRegistrationSerializer(serializers.ModelSerializer):
@@ -95,22 +98,19 @@ class GarageRegistrationSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         number_of_spots = validated_data.pop('number_of_spots')
 
-        garage = Garage.objects.create(
-            owner=request.user,  # ✅ Assign the logged-in user
-            verification_status='Pending',  # Always start as Pending
-            **validated_data
-        )
+        with transaction.atomic():
+            garage = Garage.objects.create(
+                owner=request.user,  # ✅ Assign the logged-in user
+                verification_status='Pending',  # Always start as Pending
+                **validated_data
+            )
 
-        for i in range(1, number_of_spots + 1):
-            ParkingSpot.objects.create(
+            garage.add_spots(number_of_spots)
+            # Create verification request
+            GarageVerificationRequest.objects.create(
                 garage=garage,
-                slot_number=f"SLOT-{i:03d}"
+                status='Pending'
             )
-        # Create verification request
-        GarageVerificationRequest.objects.create(
-            garage=garage,
-            status='Pending'
-        )
         return garage
 
 ########## end grage registration serializer ##########
@@ -159,33 +159,26 @@ class GarageUpdateSerializer(serializers.ModelSerializer):
         # ✅ Update all other fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-         # If critical fields changed, reset to Pending and create new verification request
-        if needs_reverification:
-            instance.verification_status = 'Pending'
-            GarageVerificationRequest.objects.create(
-                garage=instance,
-                status='Pending'
-            )
-        instance.save()
-
-        # ✅ Handle parking spots adjustment
-        if number_of_spots is not None:
-            current_count = instance.spots.count()
 
-            if number_of_spots > current_count:
-                for i in range(current_count + 1, number_of_spots + 1):
-                    ParkingSpot.objects.create(
-                        garage=instance,
-                        slot_number=f"SLOT-{i:03d}"
-                    )
-            elif number_of_spots < current_count:
-                # Only delete available spots (leave reserved/occupied untouched)
-                removable_spots = list(
-                    instance.spots.filter(status='available').order_by('-id')
+        with transaction.atomic():
+             # If critical fields changed, reset to Pending and create new verification request
+            if needs_reverification:
+                instance.verification_status = 'Pending'
+                GarageVerificationRequest.objects.create(
+                    garage=instance,
+                    status='Pending'
                 )
-                to_delete = removable_spots[:current_count - number_of_spots]
-                for spot in to_delete:
-                    spot.delete()
+            instance.save()
+
+            # ✅ Handle parking spots adjustment
+            if number_of_spots is not None:
+                current_count = instance.spots.count()
+
+                if number_of_spots > current_count:
+                    instance.add_spots(number_of_spots - current_count)
+                elif number_of_spots < current_count:
+                    # Only delete available spots (leave reserved/occupied untouched)
+                    instance.remove_available_spots(current_count - number_of_spots)
 
         return instance
 
@@ -236,7 +229,7 @@ class GarageVerificationRequestSerializer(serializers.ModelSerializer):
     
     def get_total_spots(self, obj):
         if obj.garage:
-            return obj.garage.spots.count()
+            return obj.garage.total_spots_count
         return 0
     
     def get_garage_image(self, obj):
@@ -275,7 +268,7 @@ class GarageVerificationRequestSerializer(serializers.ModelSerializer):
             'verification_status': garage.verification_status,
             'image': request.build_absolute_uri(garage.image.url) if garage.image and request else None,
             'contract_document': request.build_absolute_uri(garage.contract_document.url) if garage.contract_document and request else None,
-            'total_spots': garage.spots.count(),
+            'total_spots': garage.total_spots_count,
             'owner': {
                 'id': garage.owner.id,
                 'username': garage.owner.username,
@@ -1,3 +1,188 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from booking.models import Booking
+from .models import Garage, ParkingSpot
+
+
+def make_owner(n=1):
+    return CustomUser.objects.create_user(
+        email=f"owner{n}@example.com",
+        password="pass12345",
+        username=f"owner{n}",
+        phone=f"0100000{n:04d}",
+        national_id=f"{n:014d}",
+        role='garage_owner',
+    )
+
+
+def make_garage(owner, name="Garage", lat=30.05, lon=31.24, spots=3, **kwargs):
+    garage = Garage.objects.create(
+        owner=owner,
+        name=name,
+        address="Cairo",
+        latitude=lat,
+        longitude=lon,
+        opening_hour=datetime.time(0, 0),
+        closing_hour=datetime.time(23, 59),
+        contract_document="garage_contracts/contract.pdf",
+        verification_status=kwargs.pop('verification_status', 'Verified'),
+        **kwargs
+    )
+    garage.add_spots(spots)
+    return garage
+
+
+class NearbyGaragesViewTests(TestCase):
+    url = '/api/garages/nearby/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = make_owner()
+
+    def test_sorted_by_distance_within_radius(self):
+        far = make_garage(self.owner, "Far", lat=30.10, lon=31.24)
+        near = make_garage(self.owner, "Near", lat=30.051, lon=31.24)
+        make_garage(self.owner, "Alexandria", lat=31.20, lon=29.92)
+
+        response = self.client.get(self.url, {'lat': 30.05, 'lon': 31.24, 'radius': 20})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([g['id'] for g in response.data], [near.id, far.id])
+        self.assertLess(response.data[0]['distance'], response.data[1]['distance'])
+
+    def test_available_spots_count(self):
+        garage = make_garage(self.owner, spots=4)
+        garage.spots.first().change_status('reserved')
+
+        response = self.client.get(self.url, {'lat': 30.05, 'lon': 31.24})
+
+        self.assertEqual(response.data[0]['available_spots'], 3)
+
+    def test_query_count_is_constant(self):
+        make_garage(self.owner, "First")
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'lat': 30.05, 'lon': 31.24})
+        self.assertEqual(len(response.data), 1)
+
+        for i in range(10):
+            make_garage(self.owner, f"Garage {i}", lat=30.05 + i / 1000)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'lat': 30.05, 'lon': 31.24})
+        self.assertEqual(len(response.data), 11)
+
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'search': 'Garage'})
+
+    def test_invalid_coordinates(self):
+        response = self.client.get(self.url, {'lat': 'abc', 'lon': 31.24})
+        self.assertEqual(response.status_code, 400)
+
+
+class SpotCounterTests(TestCase):
+    def setUp(self):
+        self.garage = make_garage(make_owner(), spots=5)
+
+    def counters(self):
+        self.garage.refresh_from_db()
+        return (self.garage.available_spots_count, self.garage.reserved_spots_count, self.garage.occupied_spots_count)
+
+    def test_change_status_moves_counters(self):
+        spot = self.garage.spots.first()
+        self.assertTrue(spot.change_status('reserved'))
+        self.assertEqual(self.counters(), (4, 1, 0))
+        self.assertTrue(spot.change_status('occupied'))
+        self.assertEqual(self.counters(), (4, 0, 1))
+
+    def test_change_status_is_compare_and_swap(self):
+        spot = self.garage.spots.first()
+        stale = ParkingSpot.objects.get(pk=spot.pk)
+        self.assertTrue(spot.change_status('reserved'))
+        self.assertFalse(stale.change_status('reserved'))
+        self.assertEqual(self.counters(), (4, 1, 0))
+
+    def test_queryset_transition(self):
+        changed = self.garage.spots.order_by('id')[:3]
+        ids = ParkingSpot.objects.filter(id__in=list(changed.values_list('id', flat=True))).transition('occupied')
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(self.counters(), (2, 0, 3))
+
+    def test_bulk_add_and_remove_spots(self):
+        self.garage.spots.order_by('id').first().change_status('reserved')
+        # ids, cascade collection (spot + bookings), one DELETE, one counter UPDATE
+        with self.assertNumQueries(5):
+            self.assertEqual(self.garage.remove_available_spots(10), 4)
+        self.assertEqual(list(self.garage.spots.values_list('slot_number', flat=True)), ["SLOT-001"])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.garage.add_spots(2000)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertLessEqual(len(inserts), 7)
+        self.assertLessEqual(len(queries), len(inserts) + 4)
+        self.assertEqual(self.counters(), (2000, 1, 0))
+        self.assertEqual(self.garage.spots.order_by('-id').first().slot_number, "SLOT-2001")
+
+    def test_reconcile_repairs_drift(self):
+        ParkingSpot.objects.filter(garage=self.garage).update(status='occupied')
+        out = StringIO()
+        call_command('reconcile_spot_counters', stdout=out)
+        self.assertEqual(self.counters(), (0, 0, 5))
+        self.assertIn("Repaired 1", out.getvalue())
+
+    def test_migrate_backfills_counters(self):
+        # What a garage created before the counters existed looks like after the schema change
+        Garage.objects.filter(pk=self.garage.pk).update(
+            available_spots_count=0, reserved_spots_count=0, occupied_spots_count=0
+        )
+        emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        self.assertEqual(self.counters(), (5, 0, 0))
+
+
+class OwnerDashboardDataViewTests(TestCase):
+    url = '/api/owner/dashboard/'
+
+    def setUp(self):
+        self.owner = make_owner()
+        self.driver = CustomUser.objects.create_user(
+            email="driver@example.com", password=None, username="driver",
+            phone="01200000001", national_id="20000000000001", role='driver',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_garage(self, name, revenue):
+        garage = make_garage(self.owner, name, spots=2)
+        now = timezone.now()
+        for cost in (revenue, None):
+            Booking.objects.create(
+                driver=self.driver, garage=garage, parking_spot=garage.spots.first(),
+                reservation_expiry_time=now, start_time=now, actual_cost=cost, status='completed',
+            )
+        return garage
+
+    def test_query_count_is_constant(self):
+        self.add_garage("First", 15)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        for i in range(5):
+            self.add_garage(f"Garage {i}", 10 + i)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
 
-# Create your tests here.
+        self.assertEqual(len(response.data), 6)
+        latest = response.data[0]
+        self.assertEqual(latest['today_revenue'], 14.0)
+        self.assertEqual(len(latest['today_bookings']), 2)
+        self.assertEqual(len(latest['spots']), 2)
+        self.assertEqual(latest['available_spots_count'], 2)
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Defaults used by the nearby search when the client does not send radius/limit
+DEFAULT_NEARBY_RADIUS_KM = 10.0
+MAX_NEARBY_RADIUS_KM = 100.0
+DEFAULT_NEARBY_LIMIT = 50
+MAX_NEARBY_LIMIT = 200
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Return (min_lat, max_lat, min_lon, max_lon) of the box that encloses
+    a circle of radius_km around the given point.
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-12:
+        lon_delta = 180.0
+    else:
+        lon_delta = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return lat - lat_delta, lat + lat_delta, lon - lon_delta, lon + lon_delta
+
+
+def filter_bounding_box(queryset, lat, lon, radius_km):
+    """
+    Narrow a Garage queryset to the bounding box around the point.
+    This runs in SQL against the (verification_status, latitude, longitude) index.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    return queryset.filter(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lon, max_lon),
+    )
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Great-circle distance in km from (lat, lon) to every point in the lats/lons arrays.
+    Works on scalars too.
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def rank_by_distance(lat, lon, coords, radius_km, limit):
+    """
+    Rank an (N, 2) float64 array of (latitude, longitude) rows by distance.
+    Returns (positions, distances) of the closest `limit` rows within radius_km, nearest first.
+    """
+    distances = haversine_km(lat, lon, coords[:, 0], coords[:, 1])
+    within = np.flatnonzero(distances <= radius_km)
+    if within.size > limit:
+        # O(N) selection of the top-k, only those get fully sorted
+        within = within[np.argpartition(distances[within], limit - 1)[:limit]]
+    order = within[np.argsort(distances[within], kind='stable')]
+    return order, distances[order]
+
+
+def nearby_garages(queryset, lat, lon, radius_km=DEFAULT_NEARBY_RADIUS_KM, limit=DEFAULT_NEARBY_LIMIT):
+    """
+    Return the `limit` closest garages within radius_km of (lat, lon), nearest first.
+    Each garage gets a `distance` attribute (km) so the serializer does not recompute it.
+    """
+    rows = list(filter_bounding_box(queryset, lat, lon, radius_km).values_list('id', 'latitude', 'longitude'))
+    if not rows:
+        return []
+
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    coords = np.ascontiguousarray([row[1:] for row in rows], dtype=np.float64)
+    positions, distances = rank_by_distance(lat, lon, coords, radius_km, limit)
+
+    # Only the winners are loaded as model instances
+    garages = queryset.in_bulk(ids[positions].tolist())
+    ranked = []
+    for garage_id, distance in zip(ids[positions].tolist(), distances.tolist()):
+        garage = garages[garage_id]
+        garage.distance = distance
+        ranked.append(garage)
+    return ranked
@@ -3,16 +3,18 @@ from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from django.db.models import Avg, Q
+from django.db.models import Avg, Prefetch, Q, Sum
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
 from rest_framework.decorators import api_view, permission_classes
-from geopy.distance import geodesic
+from rest_framework.exceptions import ParseError
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.html import strip_tags
 from django.core.mail import send_mail
 from django.conf import settings
 
 from booking.models import Booking
+from booking.utils import local_day_range
 
 from .models import Garage, GarageReview, ParkingSpot, GarageVerificationRequest
 from .serializers import (
@@ -21,6 +23,10 @@ from .serializers import (
     GarageUpdateSerializer, GarageVerificationRequestSerializer,
     GarageVerificationActionSerializer
 )
+from .utils import (
+    nearby_garages, DEFAULT_NEARBY_RADIUS_KM, MAX_NEARBY_RADIUS_KM,
+    DEFAULT_NEARBY_LIMIT, MAX_NEARBY_LIMIT
+)
 
 ####################### Garage Detail View #######################
 
@@ -35,7 +41,7 @@ class GarageDetailView(APIView):
             garage.average_rating = round(garage.average_rating or 0, 1)
 
             data = GarageDetailSerializer(garage, context={'request': request}).data
-            data["number_of_spots"] = garage.spots.count()
+            data["number_of_spots"] = garage.total_spots_count
             data["average_rating"] = garage.average_rating 
             
 
@@ -69,8 +75,17 @@ class NearbyGaragesView(generics.ListAPIView):
             queryset = queryset.filter(Q(name__icontains=query) | Q(address__icontains=query))
 
         if lat and lon:
-            user_location = (float(lat), float(lon))
-            queryset = sorted(queryset, key=lambda garage: geodesic(user_location, (garage.latitude, garage.longitude)).km)
+            try:
+                lat, lon = float(lat), float(lon)
+                radius = float(self.request.query_params.get('radius', DEFAULT_NEARBY_RADIUS_KM))
+                limit = int(self.request.query_params.get('limit', DEFAULT_NEARBY_LIMIT))
+            except ValueError:
+                raise ParseError("lat, lon, radius and limit must be numbers.")
+
+            radius = min(max(radius, 0), MAX_NEARBY_RADIUS_KM)
+            limit = min(max(limit, 1), MAX_NEARBY_LIMIT)
+            # Bounding box in SQL first, then rank only the candidates
+            queryset = nearby_garages(queryset, lat, lon, radius_km=radius, limit=limit)
 
         return queryset
 
@@ -212,10 +227,9 @@ class GarageOccupancyView(APIView):
         except Garage.DoesNotExist:
             return Response({'error': 'Garage not found'}, status=404)
 
-        all_spots = ParkingSpot.objects.filter(garage=garage)
-        total_spots = all_spots.count()
-        occupied_spots = all_spots.filter(status__in=['reserved', 'occupied']).count()
-        available_spots = total_spots - occupied_spots
+        total_spots = garage.total_spots_count
+        occupied_spots = garage.reserved_spots_count + garage.occupied_spots_count
+        available_spots = garage.available_spots_count
 
         return Response({
             'garage_id': garage.id,
@@ -490,44 +504,35 @@ class OwnerDashboardDataView(generics.ListAPIView):
     
     def get(self, request):
         try:
-            # Get user's garages with proper verification status
-            # Remove the invalid 'created_at' ordering - use 'id' instead
-            garages = Garage.objects.filter(owner=request.user).order_by('-id')
-            
-            # DEBUG: Print verification statuses
-            print("🔧 Owner Dashboard - Garage statuses:")
-            for garage in garages:
-                print(f"  - {garage.name}: {garage.verification_status}")
-            
+            day_start, day_end = local_day_range()
+            today = Booking.objects.filter(start_time__gte=day_start, start_time__lt=day_end)
+
+            # Everything below is a fixed number of queries, however many garages the owner has:
+            # garages, today's bookings, spots and one grouped revenue sum
+            garages = Garage.objects.filter(owner=request.user).order_by('-id').prefetch_related(
+                Prefetch(
+                    'booking_set',
+                    queryset=today.select_related('driver', 'parking_spot'),
+                    to_attr='today_bookings',
+                ),
+                Prefetch('spots', queryset=ParkingSpot.objects.only('id', 'garage_id', 'slot_number', 'status')),
+            )
+            revenue = dict(
+                today.filter(garage__owner=request.user, actual_cost__isnull=False)
+                .values('garage')
+                .annotate(total=Sum('actual_cost'))
+                .values_list('garage', 'total')
+            )
+
+            now = timezone.localtime().time()
             garage_data = []
             for garage in garages:
-                # Get today's bookings
-                from datetime import date
-                from booking.models import Booking
-                
-                today_bookings = Booking.objects.filter(
-                    parking_spot__garage=garage,
-                    start_time__date=date.today()
-                ).select_related('driver', 'parking_spot')
-                
-                # Calculate spots counts
-                all_spots = garage.spots.all()
-                available_spots = all_spots.filter(status='available').count()
-                occupied_spots = all_spots.filter(status__in=['occupied', 'reserved']).count()
-                
-                # Calculate today's revenue
-                today_revenue = sum(
-                    booking.actual_cost for booking in today_bookings
-                    if booking.actual_cost
-                )
-                
                 # Check if garage is currently open (calculate from hours)
-                from datetime import datetime
-                now = datetime.now().time()
                 is_open = True  # Default to open if no hours specified
                 if garage.opening_hour and garage.closing_hour:
                     is_open = garage.opening_hour <= now <= garage.closing_hour
-                
+
+                today_revenue = revenue.get(garage.id)
                 garage_info = {
                     'id': garage.id,
                     'name': garage.name,
@@ -536,8 +541,9 @@ class OwnerDashboardDataView(generics.ListAPIView):
                     'is_open': is_open,
                     'opening_hour': garage.opening_hour,
                     'closing_hour': garage.closing_hour,
-                    'available_spots_count': available_spots,
-                    'occupied_spots_count': occupied_spots,
+                    # Spot counts come from the garage's live counters
+                    'available_spots_count': garage.available_spots_count,
+                    'occupied_spots_count': garage.occupied_spots_count + garage.reserved_spots_count,
                     'today_revenue': float(today_revenue) if today_revenue else 0.0,
                     'today_bookings': [
                         {
@@ -549,7 +555,7 @@ class OwnerDashboardDataView(generics.ListAPIView):
                             'total_price': booking.actual_cost,
                             'status': booking.status
                         }
-                        for booking in today_bookings
+                        for booking in garage.today_bookings
                     ],
                     'spots': [
                         {
@@ -557,16 +563,11 @@ class OwnerDashboardDataView(generics.ListAPIView):
                             'slot_number': spot.slot_number,
                             'status': spot.status
                         }
-                        for spot in all_spots
+                        for spot in garage.spots.all()
                     ]
                 }
                 garage_data.append(garage_info)
-            
-            # DEBUG: Print final garage data structure
-            print("🔧 Final garage data being returned:")
-            for garage_info in garage_data:
-                print(f"  - {garage_info['name']}: verification_status = {garage_info['verification_status']}")
-            
+
             return Response(garage_data)
             
         except Exception as e:
@@ -576,4 +577,4 @@ class OwnerDashboardDataView(generics.ListAPIView):
             return Response({
                 'error': 'Failed to fetch dashboard data',
                 'detail': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1,9 +1,8 @@
 from rest_framework import serializers
 from booking.models import Booking
 from garage.models import ParkingSpot, Garage
-from django.db.models import Sum
 from django.utils import timezone
-import datetime
+from .utils import dashboard_context
 
 class BookingSerializer(serializers.ModelSerializer):
     driver_username = serializers.CharField(source='driver.username', read_only=True)
@@ -22,9 +21,6 @@ class ParkingSpotSerializer(serializers.ModelSerializer):
         fields = ['id', 'slot_number', 'status']
 
 class GarageDashboardSerializer(serializers.ModelSerializer):
-    available_spots_count = serializers.SerializerMethodField()
-    occupied_spots_count = serializers.SerializerMethodField()
-    reserved_spots_count = serializers.SerializerMethodField()
     today_revenue = serializers.SerializerMethodField()
     today_bookings = serializers.SerializerMethodField()
     spots = ParkingSpotSerializer(many=True, read_only=True)
@@ -57,30 +53,16 @@ class GarageDashboardSerializer(serializers.ModelSerializer):
             return current_time >= opening_hour or current_time < closing_hour
 
 
-    def get_available_spots_count(self, obj):
-        return obj.spots.filter(status='available').count()
-
-    def get_occupied_spots_count(self, obj):
-        return obj.spots.filter(status='occupied').count()
-
-    def get_reserved_spots_count(self, obj):
-        return obj.spots.filter(status='reserved').count()
+    def _dashboard(self, key, obj):
+        # Filled for all garages at once by owner_dashboard.utils.dashboard_context.
+        # Without it, compute it here; under many=True the context is shared, so cover the whole list
+        if key not in self.context:
+            garages = self.parent.instance if isinstance(self.parent, serializers.ListSerializer) else [obj]
+            self.context.update(dashboard_context(garages))
+        return self.context[key]
 
     def get_today_revenue(self, obj):
-        today = timezone.localdate()
-        revenue = Booking.objects.filter(
-            garage=obj,
-            end_time__date=today,
-            actual_cost__isnull=False
-        ).aggregate(total_revenue=Sum('actual_cost'))['total_revenue']
-        return revenue or 0.00
+        return self._dashboard('today_revenue', obj).get(obj.id) or 0.00
 
     def get_today_bookings(self, obj):
-        today = timezone.localdate()
-        bookings = Booking.objects.filter(
-            garage=obj,
-            created_at__date=today
-        ).exclude(
-            status__in=['cancelled', 'expired']
-        ).order_by('-created_at')
-        return BookingSerializer(bookings, many=True).data
+        return BookingSerializer(self._dashboard('today_bookings', obj).get(obj.id, []), many=True).data
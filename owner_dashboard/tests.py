@@ -1,3 +1,189 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import CustomUser
+from booking.models import Booking
+from garage.events import garage_channel, get_broker
+from garage.tests import make_garage, make_owner
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .serializers import GarageDashboardSerializer
+from .views import OwnerDashboardAPIView
+
+
+class OwnerDashboardAPIViewTests(TestCase):
+    # garage.urls registers the same path first, so call the view directly
+    view = staticmethod(OwnerDashboardAPIView.as_view())
+
+    def setUp(self):
+        self.owner = make_owner()
+        self.driver = CustomUser.objects.create_user(
+            email="driver@example.com", password=None, username="driver",
+            phone="01200000001", national_id="20000000000001", role='driver',
+        )
+
+    def add_garage(self, name, revenue):
+        garage = make_garage(self.owner, name, spots=2)
+        now = timezone.now()
+        Booking.objects.create(
+            driver=self.driver, garage=garage, parking_spot=garage.spots.first(),
+            reservation_expiry_time=now, end_time=now, actual_cost=revenue, status='completed',
+        )
+        Booking.objects.create(
+            driver=self.driver, garage=garage, parking_spot=garage.spots.last(),
+            reservation_expiry_time=now, status='cancelled',
+        )
+        return garage
+
+    def get(self, user=None):
+        request = APIRequestFactory().get('/api/owner/dashboard/')
+        force_authenticate(request, user or self.owner)
+        response = self.view(request)
+        response.render()
+        return response
+
+    def test_query_count_is_flat(self):
+        self.add_garage("First", 15)
+        with self.assertNumQueries(4):
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+
+        for i in range(5):
+            self.add_garage(f"Garage {i}", 10 + i)
+        with self.assertNumQueries(4):
+            response = self.get()
+
+        self.assertEqual(len(response.data), 6)
+        first = next(g for g in response.data if g['name'] == "First")
+        self.assertEqual(first['today_revenue'], 15)
+        self.assertEqual([b['driver_username'] for b in first['today_bookings']], ["driver"])
+        self.assertEqual(len(first['spots']), 2)
+
+    def test_serializer_without_context_covers_every_garage(self):
+        garages = [self.add_garage(f"Garage {i}", 10 + i) for i in range(3)]
+
+        data = GarageDashboardSerializer(garages, many=True).data
+
+        self.assertEqual([g['today_revenue'] for g in data], [10, 11, 12])
+        self.assertTrue(all(len(g['today_bookings']) == 1 for g in data))
+
+    def test_no_garages(self):
+        response = self.get(make_owner(2))
+        self.assertEqual(response.status_code, 404)
+
+
+class OwnerEventStreamTests(TestCase):
+    url = '/api/owner/events/'
+
+    def setUp(self):
+        self.owner = make_owner()
+        self.garage = make_garage(self.owner, spots=2)
+        self.token = str(AccessToken.for_user(self.owner))
+
+    async def test_requires_token(self):
+        response = await AsyncClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_streams_spot_changes_after_commit(self):
+        response = await AsyncClient().get(self.url, {'token': self.token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+
+        spot = await self.garage.spots.afirst()
+
+        def reserve():
+            with self.captureOnCommitCallbacks(execute=True):
+                spot.change_status('reserved')
+        await sync_to_async(reserve)()
+
+        chunk = await asyncio.wait_for(anext(stream), timeout=5)
+        event = json.loads(chunk.decode().removeprefix("data: "))
+        self.assertEqual(event['type'], 'spots')
+        self.assertEqual(event['garage_id'], self.garage.id)
+        self.assertEqual((event['spot_ids'], event['status'], event['previous']), ([spot.id], 'reserved', 'available'))
+        await stream.aclose()
+
+    async def test_follows_garages_created_while_connected(self):
+        response = await AsyncClient().get(self.url, {'token': self.token})
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+
+        def register():
+            with self.captureOnCommitCallbacks(execute=True):
+                return make_garage(self.owner, "New", spots=1)
+        garage = await sync_to_async(register)()
+
+        event = json.loads((await asyncio.wait_for(anext(stream), timeout=5)).decode().removeprefix("data: "))
+        self.assertEqual((event['type'], event['garage_id']), ('garage.created', garage.id))
+
+        spot = await garage.spots.afirst()
+
+        def reserve():
+            with self.captureOnCommitCallbacks(execute=True):
+                spot.change_status('reserved')
+        await sync_to_async(reserve)()
+
+        event = json.loads((await asyncio.wait_for(anext(stream), timeout=5)).decode().removeprefix("data: "))
+        self.assertEqual((event['type'], event['garage_id']), ('spots', garage.id))
+        await stream.aclose()
+
+    def test_committed_changes_are_published_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.garage.spots.first().change_status('occupied')
+        self.assertEqual(len(callbacks), 1)
+
+        with mock.patch.object(get_broker(), 'publish') as publish:
+            callbacks[0]()
+        publish.assert_called_once()
+        self.assertEqual(publish.call_args.args[0], garage_channel(self.garage.id))
+
+    def test_rolled_back_changes_are_not_published(self):
+        spot = self.garage.spots.first()
+        with mock.patch.object(get_broker(), 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                spot.change_status('occupied')
+                raise RuntimeError("rolled back")
+
+        self.assertEqual(callbacks, [])
+        publish.assert_not_called()
+
+
+class UpdateSpotAvailabilityAPIViewTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.garage = make_garage(self.owner, spots=1000)
+        self.url = f'/api/owner/garages/{self.garage.id}/update-spots/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_resize_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, {'new_available_spots_count': 400}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['changed_spot_ids']), 600)
+        self.assertEqual(response.data['status'], 'occupied')
+        self.assertEqual(
+            (response.data['available_spots_count'], response.data['occupied_spots_count']), (400, 600)
+        )
+        spot_updates = [q for q in queries if q['sql'].startswith('UPDATE "garage_parkingspot"')]
+        self.assertEqual(len(spot_updates), 1)
+        self.assertEqual(self.garage.spots.filter(status='occupied').count(), 600)
+
+        response = self.client.put(self.url, {'new_available_spots_count': 450}, format='json')
+        self.assertEqual((response.data['status'], len(response.data['changed_spot_ids'])), ('available', 50))
+        self.assertEqual(response.data['available_spots_count'], 450)
+
+    def test_rejects_more_than_total(self):
+        response = self.client.put(self.url, {'new_available_spots_count': 1001}, format='json')
+        self.assertEqual(response.status_code, 400)
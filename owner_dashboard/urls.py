@@ -1,8 +1,9 @@
 
 from django.urls import path
-from .views import OwnerDashboardAPIView, UpdateSpotAvailabilityAPIView
+from .views import OwnerDashboardAPIView, UpdateSpotAvailabilityAPIView, owner_event_stream
 
 urlpatterns = [
     path('dashboard/', OwnerDashboardAPIView.as_view(), name='owner_dashboard'),
+    path('events/', owner_event_stream, name='owner_events'),
     path('garages/<int:garage_id>/update-spots/', UpdateSpotAvailabilityAPIView.as_view(), name='update_spot_availability'),
 ]
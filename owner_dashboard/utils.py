@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+from django.db.models import Prefetch, Sum
+
+from booking.models import Booking
+from booking.utils import local_day_range
+from garage.models import ParkingSpot
+
+
+def dashboard_queryset(queryset):
+    """Garage queryset with everything GarageDashboardSerializer reads from the rows themselves."""
+    return queryset.prefetch_related(
+        Prefetch('spots', queryset=ParkingSpot.objects.only('id', 'garage_id', 'slot_number', 'status').order_by('id'))
+    )
+
+
+def dashboard_context(garages):
+    """
+    Precompute today's revenue and bookings for all the given garages in two grouped queries.
+    Pass the result as serializer context so GarageDashboardSerializer doesn't query per garage.
+    """
+    ids = [garage.id for garage in garages]
+    start, end = local_day_range()
+
+    revenue = dict(
+        Booking.objects.filter(garage__in=ids, end_time__gte=start, end_time__lt=end, actual_cost__isnull=False)
+        .values('garage')
+        .annotate(total=Sum('actual_cost'))
+        .values_list('garage', 'total')
+    )
+
+    bookings = defaultdict(list)
+    today = (
+        Booking.objects.filter(garage__in=ids, created_at__gte=start, created_at__lt=end)
+        .exclude(status__in=['cancelled', 'expired'])
+        .select_related('driver', 'parking_spot')
+        .order_by('-created_at')
+    )
+    for booking in today:
+        bookings[booking.garage_id].append(booking)
+
+    return {'today_revenue': revenue, 'today_bookings': bookings}
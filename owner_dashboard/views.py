@@ -1,14 +1,23 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 from django.utils import timezone
 from django.db.models import Sum, Count, Q
 
 from accounts.models import CustomUser
 from garage.models import Garage, ParkingSpot
 from booking.models import Booking
+from garage.events import garage_channel, get_broker, owner_channel
 from .serializers import GarageDashboardSerializer, ParkingSpotSerializer
+from .utils import dashboard_context, dashboard_queryset
 
 class OwnerDashboardAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -22,20 +31,17 @@ class OwnerDashboardAPIView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        owned_garages = Garage.objects.filter(owner=user)
+        owned_garages = list(dashboard_queryset(Garage.objects.filter(owner=user)))
 
-        if not owned_garages.exists():
+        if not owned_garages:
             return Response(
                 {"detail": "No garages found for this owner."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        dashboard_data = []
-        for garage in owned_garages:
-            serializer = GarageDashboardSerializer(garage)
-            dashboard_data.append(serializer.data)
+        serializer = GarageDashboardSerializer(owned_garages, many=True, context=dashboard_context(owned_garages))
 
-        return Response(dashboard_data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 class UpdateSpotAvailabilityAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -50,7 +56,7 @@ class UpdateSpotAvailabilityAPIView(APIView):
             )
 
         try:
-            garage = Garage.objects.get(id=garage_id, owner=user)
+            garage = Garage.objects.only('id').get(id=garage_id, owner=user)
         except Garage.DoesNotExist:
             return Response(
                 {"detail": "Garage not found or you do not own this garage."},
@@ -75,29 +81,103 @@ class UpdateSpotAvailabilityAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        current_available_spots = garage.spots.filter(status='available').count()
-        total_spots_in_garage = garage.spots.count()
-
-        if new_available_spots_count > total_spots_in_garage:
-            return Response(
-                {"detail": f"Cannot set available spots to {new_available_spots_count}. Total spots in garage is {total_spots_in_garage}."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        if new_available_spots_count < current_available_spots:
-            spots_to_change = current_available_spots - new_available_spots_count
-            available_spots_to_occupy = garage.spots.filter(status='available').order_by('?')[:spots_to_change]
-            for spot in available_spots_to_occupy:
-                spot.status = 'occupied'
-                spot.save()
-        elif new_available_spots_count > current_available_spots:
-            spots_to_change = new_available_spots_count - current_available_spots
-            occupied_spots_to_make_available = garage.spots.filter(status='occupied').order_by('?')[:spots_to_change]
-            for spot in occupied_spots_to_make_available:
-                spot.status = 'available'
-                spot.save()
-
-        updated_garage = Garage.objects.get(id=garage_id)
-        serializer = GarageDashboardSerializer(updated_garage)
-
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        with transaction.atomic():
+            # Lock the garage row so concurrent resizes read settled counters
+            garage = Garage.objects.select_for_update().get(pk=garage.pk)
+            current_available_spots = garage.available_spots_count
+            total_spots_in_garage = garage.total_spots_count
+
+            if new_available_spots_count > total_spots_in_garage:
+                return Response(
+                    {"detail": f"Cannot set available spots to {new_available_spots_count}. Total spots in garage is {total_spots_in_garage}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            if new_available_spots_count < current_available_spots:
+                from_status, to_status = 'available', 'occupied'
+                spots_to_change = current_available_spots - new_available_spots_count
+            else:
+                from_status, to_status = 'occupied', 'available'
+                spots_to_change = new_available_spots_count - current_available_spots
+
+            changed_spot_ids = []
+            if spots_to_change:
+                # Lowest ids first: served by the (garage, status, id) index, no random sort
+                spot_ids = list(
+                    garage.spots.filter(status=from_status).order_by('id').values_list('id', flat=True)[:spots_to_change]
+                )
+                changed_spot_ids = ParkingSpot.objects.filter(id__in=spot_ids).transition(to_status)
+
+            counters = Garage.objects.filter(pk=garage.pk).values(
+                'available_spots_count', 'reserved_spots_count', 'occupied_spots_count'
+            ).get()
+
+        return Response({
+            'garage_id': garage.id,
+            'status': to_status,
+            'changed_spot_ids': changed_spot_ids,
+            **counters,
+        }, status=status.HTTP_200_OK)
+
+
+# Comment line sent when nothing happened, keeps proxies from closing the stream
+EVENT_STREAM_HEARTBEAT_SECONDS = 15
+
+
+async def _stream_user(request):
+    """
+    Authenticate with the usual Bearer header or ?token=<access token>,
+    since the browser EventSource API can't set headers.
+    """
+    auth = JWTAuthentication()
+    raw_token = request.GET.get("token")
+    if not raw_token:
+        header = auth.get_header(request)
+        raw_token = auth.get_raw_token(header) if header else None
+    if not raw_token:
+        return None
+    try:
+        validated = auth.get_validated_token(raw_token)
+        return await sync_to_async(auth.get_user)(validated)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def owner_event_stream(request):
+    """
+    Server-Sent Events stream of changes to the owner's garages: spot status moves
+    ("spots") and booking lifecycle events ("booking.*"). Clients load the dashboard
+    snapshot once and then apply these deltas. A garage registered while the stream is
+    open arrives as "garage.created" and is followed from then on. Must be served over ASGI.
+    """
+    user = await _stream_user(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
+    if user.role != 'garage_owner':
+        return JsonResponse({"detail": "You do not have permission to access this dashboard."}, status=403)
+
+    async def events():
+        # The owner channel is subscribed before the garages are listed, so a garage
+        # created in between still announces itself
+        subscription = get_broker().subscribe([owner_channel(user.id)])
+        try:
+            garage_ids = {garage_id async for garage_id in Garage.objects.filter(owner=user).values_list('id', flat=True)}
+            await subscription.add([garage_channel(garage_id) for garage_id in garage_ids])
+            yield "retry: 3000\n\n"
+            while True:
+                message = await subscription.get(EVENT_STREAM_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ": ping\n\n"
+                    continue
+                event = json.loads(message)
+                if event.get("type") == "garage.created" and event["garage_id"] not in garage_ids:
+                    garage_ids.add(event["garage_id"])
+                    await subscription.add([garage_channel(event["garage_id"])])
+                yield f"data: {message}\n\n"
+        finally:
+            await subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -5,6 +5,12 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The owner dashboard event stream (/api/owner/events/) is an async streaming view
+and holds its connection open, so serve the project through this module with an
+ASGI server (e.g. ``uvicorn project.asgi:application``) rather than WSGI.
+Set OWNER_EVENTS_REDIS_URL when running several workers or Celery, so every
+process sees the same events.
 """
 
 import os
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+from celery.schedules import crontab
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     'owner_dashboard',
     'reports',
     'payment',
+    'ragchat',
 
 
 ]
@@ -108,6 +110,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when an atomic block starts, so concurrent
+            # bookings queue up instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # On-disk so threaded tests get real SQLite locking, not shared-cache errors
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -182,6 +194,35 @@ SIMPLE_JWT = {
     'USER_AUTHENTICATION_FIELDS': ['email'],
 }
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Broker for tasks
+# Redis pub/sub for the owner dashboard event stream; unset = in-process (single worker only)
+OWNER_EVENTS_REDIS_URL = os.getenv('OWNER_EVENTS_REDIS_URL')
+# Needed by the weekly report fan-out (chord)
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/1')
+CELERY_BEAT_SCHEDULE = {
+    # Expires / notifies / cancels due bookings in batches (replaces per-booking ETA tasks)
+    'sweep-bookings': {
+        'task': 'booking.tasks.sweep_bookings',
+        'schedule': 30.0,
+    },
+    # Reports for every verified garage, for the Saturday-Friday week that just ended
+    'weekly-reports': {
+        'task': 'reports.tasks.schedule_weekly_reports',
+        'schedule': crontab(hour=7, minute=0, day_of_week='saturday'),
+    },
+    # Per-garage booking/revenue forecast models, refitted on the previous day's data
+    'forecast-models': {
+        'task': 'reports.tasks.train_forecast_models',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
+WEEKLY_REPORT_PARALLELISM = 8
+# FAISS index of the parking manual, written by `manage.py build_manual_index`
+RAGCHAT_INDEX_DIR = os.path.join(BASE_DIR, 'ragchat_index')
+# "openai" (text-embedding-ada-002) or "hashing" (local, offline); vectors are cached on disk per model
+RAGCHAT_EMBEDDINGS = os.getenv('RAGCHAT_EMBEDDINGS', 'openai')
+RAGCHAT_EMBEDDING_CACHE = os.path.join(RAGCHAT_INDEX_DIR, 'embeddings.sqlite3')
+# joblib artifacts of reports.forecasting (not under MEDIA_ROOT, which is served)
+FORECAST_MODEL_DIR = os.path.join(BASE_DIR, 'forecast_models')
 
 
 # إعدادات البريد الإلكتروني
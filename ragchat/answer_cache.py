@@ -0,0 +1,126 @@
+"""
+In-process cache of assistant answers.
+
+Lookups try the normalised question text first and then the nearest cached question
+embedding (cosine similarity >= RAGCHAT_ANSWER_SIMILARITY), so rephrasings of the
+popular questions are answered without a chat completion. Entries expire after
+RAGCHAT_ANSWER_CACHE_TTL seconds, the least recently used ones are evicted beyond
+RAGCHAT_ANSWER_CACHE_SIZE, and everything is dropped when the manual index changes.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from django.conf import settings
+
+ANSWER_CACHE_SIZE = getattr(settings, 'RAGCHAT_ANSWER_CACHE_SIZE', 500)
+ANSWER_CACHE_TTL = getattr(settings, 'RAGCHAT_ANSWER_CACHE_TTL', 24 * 60 * 60)
+ANSWER_SIMILARITY = getattr(settings, 'RAGCHAT_ANSWER_SIMILARITY', 0.92)
+
+Entry = namedtuple('Entry', 'answer vector expires_at')
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop surrounding punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip(" \t?!.,;:؟")
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.index_hash = None
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.metrics = dict.fromkeys(('exact_hits', 'semantic_hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    def ensure_index(self, index_hash):
+        """Drop every answer if they were generated from another version of the manual."""
+        with self._lock:
+            if index_hash != self.index_hash:
+                if self._entries:
+                    self.metrics['invalidations'] += 1
+                self._entries.clear()
+                self._matrix = None
+                self.index_hash = index_hash
+
+    def get(self, question, embed=None):
+        """
+        (answer, source, vector) where source is "exact", "semantic" or None on a miss.
+        `embed()` is only called after an exact miss, for the question's embedding;
+        that vector is returned so the caller can reuse it for retrieval and put().
+        """
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.metrics['exact_hits'] += 1
+                return entry.answer, "exact", None
+
+        vector = embed() if embed else None
+        with self._lock:
+            if vector is not None:
+                match = self._nearest(vector, time.monotonic())
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.metrics['semantic_hits'] += 1
+                    return self._entries[match].answer, "semantic", vector
+            self.metrics['misses'] += 1
+        return None, None, vector
+
+    def put(self, question, answer, vector=None):
+        key = normalize_question(question)
+        if vector is not None:
+            vector = np.asarray(vector, dtype='float32')
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else None
+        with self._lock:
+            self._entries[key] = Entry(answer, vector, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+            self._matrix = None
+
+    def _nearest(self, vector, now):
+        """Key of the most similar live cached question above the threshold. Called under the lock."""
+        expired = [key for key, entry in self._entries.items() if entry.expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+            self.metrics['evictions'] += 1
+        if expired:
+            self._matrix = None
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+            self._matrix = (
+                np.stack([self._entries[key].vector for key in self._matrix_keys]) if self._matrix_keys else None
+            )
+        if self._matrix is None:
+            return None
+
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        if not norm or vector.shape[0] != self._matrix.shape[1]:
+            return None
+        similarities = self._matrix @ (vector / norm)
+        best = int(np.argmax(similarities))
+        return self._matrix_keys[best] if similarities[best] >= self.threshold else None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics['exact_hits'] + self.metrics['semantic_hits'] + self.metrics['misses']
+            hits = lookups - self.metrics['misses']
+            return {
+                **self.metrics,
+                'entries': len(self._entries),
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,183 @@
+"""
+Embedding providers for the manual assistant.
+
+get_embedder() returns the configured provider (RAGCHAT_EMBEDDINGS: "openai" or
+"hashing") wrapped in a persistent SQLite cache keyed by (model, sha256 of the
+text), so a text is only ever sent to the API once per model.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+OPENAI_EMBED_MODEL = "text-embedding-ada-002"
+# Texts per embeddings API request
+EMBED_BATCH_SIZE = 100
+# SQLite's default limit on query parameters is 999
+LOOKUP_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class EmbeddingProvider:
+    """Turns texts into float32 vectors, one row per text. `model` names the vector space."""
+
+    model = None
+    batch_size = EMBED_BATCH_SIZE
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, model=OPENAI_EMBED_MODEL, api_key=None):
+        self.model = model
+        self._api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use so the app starts (and tests run) without a key
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+
+                    api_key = self._api_key or getattr(settings, 'OPENAI_API_KEY', None) or os.environ.get("OPENAI_API_KEY")
+                    if not api_key:
+                        raise ImproperlyConfigured("OPENAI_API_KEY is required for OpenAI embeddings")
+                    self._client = OpenAI(api_key=api_key)
+        return self._client
+
+    def embed(self, texts):
+        result = self.client.embeddings.create(input=list(texts), model=self.model)
+        return np.array([e.embedding for e in result.data], dtype='float32')
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic, offline embedder: word unigrams and bigrams hashed into `dimension`
+    signed buckets with sublinear term frequency, L2-normalised. No model download and
+    no network, so it suits tests and deployments without an API key.
+    """
+
+    batch_size = 1000
+
+    def __init__(self, dimension=512):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def _bucket(self, term):
+        digest = hashlib.blake2b(term.encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dimension, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            tokens = TOKEN_RE.findall(text.lower())
+            counts = {}
+            for term in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                bucket, sign = self._bucket(term)
+                vectors[row, bucket] += sign * (1 + np.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class CachedEmbedder:
+    """
+    A provider behind a persistent (model, text hash) -> vector cache in SQLite.
+    Misses are embedded in batches of provider.batch_size and written back.
+    """
+
+    def __init__(self, provider, path):
+        self.provider = provider
+        self.path = path
+        self._local = threading.local()
+        self.hits = self.misses = 0
+
+    @property
+    def model(self):
+        return self.provider.model
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embedding "
+                "(model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, key))"
+            )
+            self._local.connection = connection
+        return connection
+
+    def embed(self, texts):
+        """float32 array with one row per text, in order."""
+        texts = list(texts)
+        keys = [text_key(text) for text in texts]
+        connection = self._connection()
+
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), LOOKUP_BATCH_SIZE):
+            batch = unique[i:i + LOOKUP_BATCH_SIZE]
+            rows = connection.execute(
+                f"SELECT key, vector FROM embedding WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                [self.model, *batch],
+            )
+            found.update((key, np.frombuffer(vector, dtype='float32')) for key, vector in rows)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+        missing_keys = list(missing)
+        for i in range(0, len(missing_keys), self.provider.batch_size):
+            batch = missing_keys[i:i + self.provider.batch_size]
+            vectors = self.provider.embed([missing[key] for key in batch])
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embedding (model, key, vector) VALUES (?, ?, ?)",
+                    [(self.model, key, vector.astype('float32').tobytes()) for key, vector in zip(batch, vectors)],
+                )
+            found.update(zip(batch, vectors))
+
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        return np.array([found[key] for key in keys], dtype='float32')
+
+
+PROVIDERS = {
+    'openai': OpenAIEmbeddingProvider,
+    'hashing': HashingEmbeddingProvider,
+}
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                name = getattr(settings, 'RAGCHAT_EMBEDDINGS', 'openai')
+                if name not in PROVIDERS:
+                    raise ImproperlyConfigured(f"Unknown RAGCHAT_EMBEDDINGS provider {name!r}")
+                path = getattr(
+                    settings, 'RAGCHAT_EMBEDDING_CACHE', os.path.join(settings.BASE_DIR, 'ragchat_index', 'embeddings.sqlite3')
+                )
+                _embedder = CachedEmbedder(PROVIDERS[name](), path)
+    return _embedder
@@ -0,0 +1,89 @@
+"""
+Formatting rules for assistant answers, applied one line at a time so a streamed
+answer can be forwarded as it arrives and still come out exactly like a complete one.
+"""
+import re
+
+# Markdown emphasis and headings are dropped
+MARKUP_RE = re.compile(r"\*+|#+")
+# Breaks inserted inside a line: before a numbered step that follows text,
+# and before a bullet that follows the end of a sentence
+STEP_BREAK_RE = re.compile(r"(?<=\S)\s+(?=\d+\.(?:\s|$))")
+BULLET_BREAK_RE = re.compile(r"(?<=[.!?])\s*(?=•)")
+# Lines that must be preceded by a blank line
+STEP_RE = re.compile(r"^(?:\d+\.|•)")
+
+CLOSING_PHRASES = (
+    'feel free', 'let me know', 'any other', 'help you',
+    'questions', 'need more', 'anything else',
+)
+CLOSING = "\n\n💡 Need more help? Feel free to ask! 😊"
+
+
+class ResponseFormatter:
+    """
+    Incremental version of the answer clean-up:
+
+    - ** / * / # markup is removed
+    - every numbered step and every bullet starts its own paragraph (one blank line before it)
+    - runs of blank lines collapse to one, leading and trailing blank lines are dropped
+    - a friendly closing line is appended when the answer has none
+
+    feed() returns the formatted text of the lines completed so far; finish() flushes
+    the last line and the closing.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._newlines = 0
+        self._started = False
+        self._has_closing = False
+
+    def feed(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        out = []
+        for line in lines:
+            out.append(self._line(line))
+            self._newlines += 1
+        return "".join(out)
+
+    def finish(self):
+        out = self._line(self._buffer)
+        self._buffer = ""
+        if not self._has_closing:
+            out += CLOSING
+            self._has_closing = True
+        return out
+
+    def _line(self, line):
+        line = MARKUP_RE.sub("", line)
+        line = STEP_BREAK_RE.sub("\n\n", line)
+        line = BULLET_BREAK_RE.sub("\n\n", line)
+
+        out = []
+        for i, part in enumerate(line.split("\n")):
+            if i:
+                self._newlines += 1
+            part = part.rstrip()
+            if not part.strip():
+                continue
+            if not self._started:
+                part = part.lstrip()
+                breaks = ""
+            elif STEP_RE.match(part.lstrip()):
+                part = part.lstrip()
+                breaks = "\n\n"
+            else:
+                breaks = "\n" * min(self._newlines, 2)
+            out.append(breaks + part)
+            self._started = True
+            self._newlines = 0
+            if not self._has_closing and any(phrase in part.lower() for phrase in CLOSING_PHRASES):
+                self._has_closing = True
+        return "".join(out)
+
+
+def format_response(text):
+    formatter = ResponseFormatter()
+    return formatter.feed(text) + formatter.finish()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ragchat.vector_store import MANUAL_DIR, ManualVectorStore
+
+
+class Command(BaseCommand):
+    help = "Embed the parking manuals and write their FAISS index to RAGCHAT_INDEX_DIR (skipped when it is current)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manual', default=MANUAL_DIR, help="Manual text file, or directory of *.txt manuals, to index.")
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the stored index matches the manuals.")
+
+    def handle(self, *args, **options):
+        store = ManualVectorStore(options['manual'], rebuild=options['force'])
+        verb = "Built" if store.built else "Index is current:"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(store.chunks)} chunks ({store.index.ntotal} vectors) in {store.directory}, hash {store.hash[:12]}."
+        ))
@@ -0,0 +1,170 @@
+"""
+Chunking and keyword retrieval for the manual index.
+
+Manuals are split along their headings into chunks of at most CHUNK_SIZE characters,
+each starting with its section heading and overlapping the previous chunk by up to
+CHUNK_OVERLAP characters. BM25 keyword scores and FAISS vector ranks are merged with
+reciprocal rank fusion in ManualVectorStore.search.
+"""
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from .embeddings import TOKEN_RE
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+# Constant of reciprocal rank fusion; larger values flatten the difference between ranks
+RRF_K = 60
+
+ARABIC_RE = re.compile(r"[؀-ۿ]")
+LATIN_RE = re.compile(r"[A-Za-z]")
+
+
+def detect_language(text):
+    """'ar' when Arabic letters outnumber Latin ones, else 'en'."""
+    return 'ar' if len(ARABIC_RE.findall(text)) > len(LATIN_RE.findall(text)) else 'en'
+
+
+def manual_language(path, text):
+    """Language tag of a manual: a _<lang> filename suffix (parking_manual_ar.txt), else detected."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix, _, suffix = stem.rpartition('_')
+    if prefix and len(suffix) == 2 and suffix.isalpha():
+        return suffix.lower()
+    return detect_language(text)
+
+
+def is_heading(line):
+    """Markdown '#' headings, or short Latin lines in capitals (the manual's section titles)."""
+    stripped = line.strip()
+    if stripped.startswith('#'):
+        return True
+    return (
+        3 <= len(stripped) <= 80
+        and stripped.upper() == stripped
+        and len(LATIN_RE.findall(stripped)) >= 3
+    )
+
+
+def _sections(text):
+    """(heading, [paragraph, ...]) in document order; paragraphs are blank-line separated blocks."""
+    heading, paragraphs, block = "", [], []
+    sections = []
+
+    def flush_block():
+        if block:
+            paragraphs.append("\n".join(block))
+            block.clear()
+
+    for line in text.splitlines():
+        if is_heading(line):
+            flush_block()
+            if paragraphs:
+                sections.append((heading, paragraphs))
+            heading, paragraphs = line.strip().lstrip('#').strip(), []
+        elif line.strip():
+            block.append(line.strip())
+        else:
+            flush_block()
+    flush_block()
+    if paragraphs:
+        sections.append((heading, paragraphs))
+    return sections
+
+
+def _windows(paragraph, size, overlap):
+    """A paragraph too long for one chunk, cut into overlapping windows at word boundaries."""
+    if len(paragraph) <= size:
+        yield paragraph
+        return
+    words, window = paragraph.split(), []
+    for word in words:
+        if window and len(" ".join(window + [word])) > size:
+            yield " ".join(window)
+            kept = []
+            for previous in reversed(window):
+                if len(" ".join([previous] + kept)) > overlap:
+                    break
+                kept.insert(0, previous)
+            window = kept
+        window.append(word)
+    if window:
+        yield " ".join(window)
+
+
+def split_manual(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """[(section heading, chunk text)]; chunks never cross a heading and never cut a paragraph that fits."""
+    chunks = []
+    for heading, paragraphs in _sections(text):
+        budget = chunk_size - len(heading) - 1
+        pieces = [piece for paragraph in paragraphs for piece in _windows(paragraph, budget, overlap)]
+        current = []
+        for piece in pieces:
+            if current and len("\n".join(current + [piece])) > budget:
+                chunks.append((heading, "\n".join(current)))
+                # Carry the tail of this chunk into the next one
+                carried = []
+                for previous in reversed(current):
+                    if len("\n".join([previous] + carried)) > overlap:
+                        break
+                    carried.insert(0, previous)
+                current = carried
+            current.append(piece)
+        if current:
+            chunks.append((heading, "\n".join(current)))
+    return [(heading, f"{heading}\n{body}" if heading else body) for heading, body in chunks]
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25:
+    """Okapi BM25 over a fixed list of texts, with the per-term weights precomputed in a sparse matrix."""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        vocabulary = {}
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                rows.append(row)
+                cols.append(vocabulary.setdefault(token, len(vocabulary)))
+        self.vocabulary = vocabulary
+        shape = (len(texts), len(vocabulary))
+        tf = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+        tf.sum_duplicates()
+
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        average = lengths.mean() if len(texts) else 0.0
+        df = np.bincount(tf.indices, minlength=len(vocabulary))
+        idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+
+        tf = tf.tocoo()
+        norm = k1 * (1 - b + b * lengths[tf.row] / (average or 1))
+        weights = idf[tf.col] * tf.data * (k1 + 1) / (tf.data + norm)
+        self.weights = sparse.csc_matrix((weights, (tf.row, tf.col)), shape=shape)
+
+    def scores(self, query):
+        columns = [self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary]
+        if not columns:
+            return np.zeros(self.weights.shape[0])
+        return np.asarray(self.weights[:, columns].sum(axis=1)).ravel()
+
+    def rank(self, query, limit):
+        """Indices of the best scoring texts (score > 0), best first."""
+        scores = self.scores(query)
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return [int(i) for i in best if scores[i] > 0]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge several best-first lists of ids: each id scores sum(1 / (k + rank))."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] += 1 / (k + rank)
+    return sorted(scores, key=lambda item: -scores[item])
@@ -1,3 +1,290 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from django.core.management import call_command
+from django.test import AsyncClient, SimpleTestCase, override_settings
+
+from . import utils
+from .answer_cache import AnswerCache
+from .embeddings import CachedEmbedder, HashingEmbeddingProvider
+from .formatting import ResponseFormatter, format_response
+from .retrieval import BM25, reciprocal_rank_fusion, split_manual
+from .vector_store import ManualIndexMissing, ManualVectorStore
+
+
+def fake_embeddings(texts):
+    return [np.array([len(text), text.count(" "), 1.0], dtype='float32') for text in texts]
+
+
+@mock.patch('ragchat.vector_store.get_embeddings', side_effect=fake_embeddings)
+class ManualVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.manual = f"{self.directory}/manual.txt"
+        self.write_manual("How to book a spot. " * 40)
+        # Nothing here may need a real OpenAI key
+        env = mock.patch.dict(os.environ)
+        env.start()
+        self.addCleanup(env.stop)
+        os.environ.pop("OPENAI_API_KEY", None)
+
+    def write_manual(self, text):
+        with open(self.manual, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_index_is_built_once_and_reloaded(self, embeddings):
+        built = ManualVectorStore(self.manual, self.directory)
+        self.assertTrue(built.built)
+        embeddings.reset_mock()
+
+        loaded = ManualVectorStore(self.manual, self.directory)
+        self.assertFalse(loaded.built)
+        self.assertEqual(loaded.chunks, built.chunks)
+        self.assertEqual(loaded.index.ntotal, len(built.chunks))
+        self.assertFalse(loaded.is_stale())
+        # Only the query was embedded
+        self.assertEqual(len(loaded.search("book", k=2)), 2)
+        embeddings.assert_called_once_with(["book"])
+
+        self.write_manual("Cancelling a booking. " * 10)
+        self.assertTrue(loaded.is_stale())
+        self.assertTrue(ManualVectorStore(self.manual, self.directory).built)
+
+    def test_concurrent_builds_publish_a_whole_index(self, embeddings):
+        threads = [
+            threading.Thread(target=ManualVectorStore, args=(self.manual, self.directory), kwargs={'rebuild': True})
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ["chunks.json", "manual.faiss", "manual.txt"])
+        self.assertFalse(ManualVectorStore(self.manual, self.directory).built)
+
+    def test_assistant_only_loads_a_built_index(self, embeddings):
+        build = lambda: call_command('build_manual_index', manual=self.manual, stdout=mock.MagicMock())
+        with mock.patch.object(utils, 'MANUAL_DIR', self.manual), \
+                override_settings(RAGCHAT_INDEX_DIR=self.directory), \
+                mock.patch.object(utils, '_assistant', None):
+            with self.assertRaises(ManualIndexMissing), self.assertLogs('ragchat.utils', 'ERROR'):
+                utils.get_assistant()
+            build()
+            assistant = utils.get_assistant()
+            self.assertIs(utils.get_assistant(), assistant)
+
+            # Changed manual, old index: keep answering from it without embedding anything
+            self.write_manual("Topping up the wallet. " * 10)
+            embeddings.reset_mock()
+            with self.assertLogs('ragchat.utils', 'WARNING'):
+                self.assertIs(utils.get_assistant(), assistant)
+            self.assertIs(utils.get_assistant(), assistant)
+            embeddings.assert_not_called()
+
+            build()
+            self.assertIsNot(utils.get_assistant(), assistant)
+
+            # The missing key only surfaces once a completion is needed
+            with mock.patch.object(utils, 'answer_cache', AnswerCache()), self.assertLogs('ragchat.utils', 'ERROR'):
+                self.assertIn("OPENAI_API_KEY", assistant.ask("How do I pay?")[0])
+
+    def test_repeated_question_skips_the_completion(self, embeddings):
+        with mock.patch.object(utils, 'MANUAL_DIR', self.manual), \
+                override_settings(RAGCHAT_INDEX_DIR=self.directory), \
+                mock.patch.object(utils, 'answer_cache', AnswerCache()):
+            assistant = utils.ParklyAssistant()
+            with mock.patch.object(assistant, '_client') as client:
+                client.chat.completions.create.return_value.choices = [
+                    mock.Mock(message=mock.Mock(content="Open the app and tap Book. Let me know!"))
+                ]
+                first = assistant.ask("How do I book?")
+                second = assistant.ask("how do I book")
+
+        self.assertEqual((first[1], second), (None, (first[0], "exact")))
+        client.chat.completions.create.assert_called_once()
+
+    def test_command_skips_a_current_index(self, embeddings):
+        with override_settings(RAGCHAT_INDEX_DIR=self.directory):
+            call_command('build_manual_index', manual=self.manual, stdout=mock.MagicMock())
+            embeddings.reset_mock()
+            call_command('build_manual_index', manual=self.manual, stdout=mock.MagicMock())
+        embeddings.assert_not_called()
+
+
+class EmbeddingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.cache_path = f"{directory}/embeddings.sqlite3"
+
+    def test_hashing_embedder_is_deterministic(self):
+        provider = HashingEmbeddingProvider(dimension=256)
+        a, b, c = provider.embed(["How do I cancel a booking?", "how do i cancel my booking", "Top up the wallet"])
+        self.assertTrue(np.array_equal(a, HashingEmbeddingProvider(dimension=256).embed(["How do I cancel a booking?"])[0]))
+        self.assertAlmostEqual(float(np.linalg.norm(a)), 1.0, places=5)
+        self.assertGreater(a @ b, a @ c)
+
+    def test_cache_only_embeds_new_texts_in_batches(self):
+        provider = HashingEmbeddingProvider(dimension=64)
+        provider.batch_size = 2
+        embedder = CachedEmbedder(provider, self.cache_path)
+        with mock.patch.object(provider, 'embed', wraps=provider.embed) as embed:
+            first = embedder.embed(["one", "two", "three", "one"])
+            self.assertEqual([len(call.args[0]) for call in embed.call_args_list], [2, 1])
+
+            embed.reset_mock()
+            # A fresh embedder on the same file still hits the cache
+            again = CachedEmbedder(provider, self.cache_path).embed(["three", "one", "four"])
+            embed.assert_called_once_with(["four"])
+
+        self.assertTrue(np.array_equal(first[0], first[3]))
+        self.assertTrue(np.array_equal(again[1], first[0]))
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.provider = HashingEmbeddingProvider(dimension=256)
+        self.cache = AnswerCache(max_entries=2, ttl=60, threshold=0.6)
+        self.cache.ensure_index("v1")
+
+    def embed(self, question):
+        return lambda: self.provider.embed([question])[0]
+
+    def test_exact_and_semantic_hits(self):
+        question = "How do I cancel a booking?"
+        self.assertEqual(self.cache.get(question, self.embed(question))[:2], (None, None))
+        self.cache.put(question, "Open My Bookings and tap Cancel.", self.provider.embed([question])[0])
+
+        embed = mock.Mock()
+        self.assertEqual(self.cache.get("  how do i CANCEL a booking ", embed)[:2], ("Open My Bookings and tap Cancel.", "exact"))
+        embed.assert_not_called()
+        self.assertEqual(self.cache.get("how do I cancel my booking", self.embed("how do I cancel my booking"))[1], "semantic")
+        self.assertEqual(self.cache.get("top up wallet", self.embed("top up wallet"))[1], None)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['exact_hits'], stats['semantic_hits'], stats['misses']), (1, 1, 2))
+
+    def test_lru_ttl_and_invalidation(self):
+        for question in ("one", "two"):
+            self.cache.put(question, question.upper())
+        self.cache.get("one")
+        self.cache.put("three", "THREE")
+        # "two" was the least recently used
+        self.assertEqual([self.cache.get(q)[0] for q in ("one", "two", "three")], ["ONE", None, "THREE"])
+
+        with mock.patch('ragchat.answer_cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(self.cache.get("one")[0])
+
+        self.cache.ensure_index("v2")
+        self.assertIsNone(self.cache.get("three")[0])
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+
+RAW_ANSWER = """  **Booking a spot** 🚗
+Open the app. 1. Search for a garage 2. Pick a spot.• Pay from your wallet
+
+
+
+### Done
+"""
+
+
+class ResponseFormatterTests(SimpleTestCase):
+    def test_rules(self):
+        self.assertEqual(format_response(RAW_ANSWER), (
+            "Booking a spot 🚗\nOpen the app.\n\n1. Search for a garage\n\n2. Pick a spot.\n\n• Pay from your wallet"
+            "\n\n Done\n\n💡 Need more help? Feel free to ask! 😊"
+        ))
+        self.assertEqual(format_response("Anything else I can help you with?"), "Anything else I can help you with?")
+
+    def test_streamed_output_matches_whole_answer(self):
+        for size in (1, 3, 7, 50):
+            formatter = ResponseFormatter()
+            streamed = "".join(formatter.feed(RAW_ANSWER[i:i + size]) for i in range(0, len(RAW_ANSWER), size))
+            self.assertEqual(streamed + formatter.finish(), format_response(RAW_ANSWER))
+
+
+class RagChatStreamTests(SimpleTestCase):
+    def stream_chunks(self, *tokens):
+        return [mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=token))]) for token in tokens]
+
+    async def test_streams_formatted_lines(self):
+        assistant = mock.Mock()
+        assistant.stream = lambda question: utils.ParklyAssistant.stream(assistant, question)
+        assistant._lookup.return_value = (None, None, None)
+        assistant._completion_request.return_value = {}
+        assistant.client.chat.completions.create.return_value = self.stream_chunks("Steps: 1. Op", "en\n2. Pay", None)
+
+        with mock.patch('ragchat.views.get_assistant', return_value=assistant), \
+                mock.patch.object(utils, 'answer_cache', AnswerCache()):
+            response = await AsyncClient().get('/api/rag/ask/stream/', {'question': "How do I book?"})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = [chunk.decode() async for chunk in response.streaming_content]
+
+        self.assertEqual(events[0], 'data: {"delta": "Steps:\\n\\n1. Open"}\n\n')
+        self.assertEqual(events[-1], 'event: done\ndata: {"cached": null}\n\n')
+        assistant.client.chat.completions.create.assert_called_once_with(stream=True)
+
+    async def test_missing_question(self):
+        response = await AsyncClient().post('/api/rag/ask/stream/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+MANUAL = """PARKLY MANUAL
+
+    BOOKING
+
+Open the map and pick a garage.
+
+Choose a free spot and confirm the booking.
+
+    CANCELLATION POLICY
+
+You can cancel a booking before the grace period ends.
+
+Late cancellations block the account for a few hours.
+"""
+
+
+class RetrievalTests(SimpleTestCase):
+    def test_chunks_follow_headings_with_overlap(self):
+        chunks = split_manual(MANUAL)
+        self.assertEqual([section for section, _ in chunks], ["BOOKING", "CANCELLATION POLICY"])
+        self.assertTrue(chunks[1][1].startswith("CANCELLATION POLICY\nYou can cancel"))
+
+        long_section = "    WALLET\n\n" + "\n\n".join(f"Step {i} of topping up the wallet." for i in range(40))
+        chunks = split_manual(long_section, chunk_size=200, overlap=40)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(text) <= 200 and text.startswith("WALLET\n") for _, text in chunks))
+        # The last paragraph of a chunk opens the next one
+        self.assertEqual(chunks[0][1].splitlines()[-1], chunks[1][1].splitlines()[1])
+
+    def test_bm25_and_fusion(self):
+        texts = [text for _, text in split_manual(MANUAL)]
+        self.assertEqual(BM25(texts).rank("late cancellation", 5), [1])
+        self.assertEqual(BM25(texts).rank("nothing matches", 5), [])
+        self.assertEqual(reciprocal_rank_fusion([[3, 1, 2], [1, 4]]), [1, 3, 4, 2])
+
+    @mock.patch('ragchat.vector_store.get_embeddings', side_effect=fake_embeddings)
+    def test_hybrid_search_over_several_manuals(self, embeddings):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with open(f"{directory}/manual.txt", 'w', encoding='utf-8') as f:
+            f.write(MANUAL)
+        with open(f"{directory}/manual_ar.txt", 'w', encoding='utf-8') as f:
+            f.write("# الحجز\n\nافتح الخريطة واختر الجراج.\n")
+
+        with mock.patch('ragchat.vector_store.HNSW_THRESHOLD', 1):
+            store = ManualVectorStore(directory, f"{directory}/index")
+        self.assertIsInstance(store.index, faiss.IndexHNSW)
+        self.assertEqual({chunk['lang'] for chunk in store.chunks}, {'en', 'ar'})
+
+        self.assertTrue(store.search("late cancellation", k=1)[0].startswith("CANCELLATION POLICY"))
+        self.assertEqual(store.search("اختر الجراج", k=3), ["الحجز\nافتح الخريطة واختر الجراج."])
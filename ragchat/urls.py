@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import rag_chat
+from .views import answer_cache_stats, rag_chat, rag_chat_stream
 
 urlpatterns = [
     path("ask/", rag_chat),
+    path("ask/stream/", rag_chat_stream),
+    path("cache-stats/", answer_cache_stats),
 ]
@@ -18,45 +18,53 @@
 #         max_tokens=500
 #     )
 #     return response.choices[0].message.content.strip()
-from .vector_store import ManualVectorStore
+from .answer_cache import answer_cache
+from .formatting import ResponseFormatter, format_response
+from .vector_store import MANUAL_DIR, ManualIndexMissing, ManualVectorStore
 from openai import OpenAI
 import os
 import logging
+import threading
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMPTY_QUESTION_REPLY = "🤔 Please ask me a specific question about the Smart Parking App!"
+
+
+def error_reply(error) -> str:
+    return f"🚫 Sorry, I encountered an error while processing your question. Please try again!\n\nError details: {str(error)}"
+
+
 class ParklyAssistant:
     """
     Enhanced RAG-based assistant for Smart Parking App
     """
     
-    def __init__(self, data_path: str = None):
+    def __init__(self, data_path: str = None, build_index: bool = True):
         """
-        Initialize the assistant with vector store and OpenAI client
+        Initialize the assistant with its vector store
         
         Args:
-            data_path: Path to the parking manual data file
+            data_path: Parking manual file, or directory of *.txt manuals (default: ragchat/data)
+            build_index: Embed the manuals when no stored index matches them, else raise ManualIndexMissing
         """
         # Setup paths
         if data_path is None:
-            data_path = os.path.join("ragchat", "data", "parking_manual.txt")
+            data_path = MANUAL_DIR
         
         # Initialize vector store
         try:
-            self.store = ManualVectorStore(data_path)
+            self.store = ManualVectorStore(data_path, build_missing=build_index)
             logger.info(f"Vector store initialized with data from: {data_path}")
         except Exception as e:
             logger.error(f"Failed to initialize vector store: {e}")
             raise
         
-        # Initialize OpenAI client
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-        
-        self.client = OpenAI(api_key=api_key)
+        # The OpenAI client is created on the first completion (see client)
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
         
         # Response configuration
@@ -64,6 +72,21 @@ class ParklyAssistant:
         self.temperature = 0.7
         self.max_chunks = 5  # Limit context chunks for better performance
         
+    @property
+    def client(self):
+        """
+        OpenAI client, created on first use so cache hits and the offline embeddings
+        work without an API key; a missing key fails the first completion instead
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    api_key = os.environ.get("OPENAI_API_KEY")
+                    if not api_key:
+                        raise ValueError("OPENAI_API_KEY environment variable is required")
+                    self._client = OpenAI(api_key=api_key)
+        return self._client
+
     def _get_system_prompt(self) -> str:
         """
         Generate the system prompt for Parkly Assistant
@@ -129,50 +152,8 @@ class ParklyAssistant:
         Returns:
             Enhanced and formatted response with proper line breaks
         """
-        # Clean the response
-        enhanced = response.strip()
-        
-        # Remove any asterisks or complex formatting
-        enhanced = enhanced.replace('**', '')
-        enhanced = enhanced.replace('*', '')
-        
-        import re
-        
-        # CRITICAL: Fix numbered steps - ensure each number starts on completely new line
-        # First, add line breaks before any number followed by period
-        enhanced = re.sub(r'(\s)(\d+\.)', r'\1\n\n\2', enhanced)
-        enhanced = re.sub(r'^(\d+\.)', r'\n\1', enhanced, flags=re.MULTILINE)
-        
-        # More aggressive: split on numbers anywhere in text
-        enhanced = re.sub(r'(\w+)\s+(\d+\.\s+)', r'\1\n\n\2', enhanced)
-        
-        # Fix cases where numbers come after periods or sentences
-        enhanced = re.sub(r'([.!?])\s*(\d+\.)', r'\1\n\n\2', enhanced)
-        
-        # Fix bullet points - ensure each bullet starts on new line  
-        enhanced = re.sub(r'([.!?])\s*•', r'\1\n\n•', enhanced)
-        enhanced = re.sub(r'^•', r'\n•', enhanced, flags=re.MULTILINE)
-        
-        # Clean up multiple newlines but keep double breaks before numbers
-        enhanced = re.sub(r'\n{4,}', '\n\n', enhanced)
-        
-        # Remove any remaining complex formatting
-        enhanced = enhanced.replace('##', '')
-        enhanced = enhanced.replace('#', '')
-        
-        # Clean up the start
-        enhanced = enhanced.lstrip('\n')
-        
-        # Add friendly closing if not present
-        closing_phrases = [
-            'feel free', 'let me know', 'any other', 'help you', 
-            'questions', 'need more', 'anything else'
-        ]
-        
-        if not any(phrase in enhanced.lower() for phrase in closing_phrases):
-            enhanced += "\n\n💡 Need more help? Feel free to ask! 😊"
-        
-        return enhanced
+        # Same line-by-line rules as the streamed answers
+        return format_response(response)
     
     def ask_with_context(self, question: str) -> str:
         """
@@ -184,18 +165,39 @@ class ParklyAssistant:
         Returns:
             Formatted response with context
         """
-        try:
-            # Validate input
-            if not question or not question.strip():
-                return "🤔 Please ask me a specific question about the Smart Parking App!"
-            
-            # Search for relevant context
-            logger.info(f"Searching for context: {question[:50]}...")
-            chunks = self.store.search(question)
-            context = self._format_context(chunks)
+        return self.ask(question)[0]
+
+    def _lookup(self, question: str):
+        """
+        Check the answer cache for the question
+        
+        Returns:
+            (cached answer or None, cache hit kind, question embedding if it was computed)
+        """
+        answer_cache.ensure_index(self.store.hash)
+        cached, source, query_vec = answer_cache.get(question, embed=lambda: self.store.embed_query(question))
+        if cached is not None:
+            logger.info(f"Answer cache {source} hit: {question[:50]}")
+        return cached, source, query_vec
+
+    def _completion_request(self, question: str, query_vec=None) -> dict:
+        """
+        Retrieve context for the question and build the chat completion arguments
+        
+        Args:
+            question: User's question about the parking app
+            query_vec: The question's embedding, if already computed
             
-            # Create the prompt
-            user_prompt = f"""Based on the following information about the Smart Parking App:
+        Returns:
+            Keyword arguments for client.chat.completions.create
+        """
+        # Search for relevant context
+        logger.info(f"Searching for context: {question[:50]}...")
+        chunks = self.store.search(question, query_vec=query_vec)
+        context = self._format_context(chunks)
+        
+        # Create the prompt
+        user_prompt = f"""Based on the following information about the Smart Parking App:
 
 {context}
 
@@ -213,29 +215,94 @@ Title with emoji
 
 Each number MUST be on its own line with a line break before it. Never put multiple steps in the same paragraph."""
 
+        return dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._get_system_prompt()},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            presence_penalty=0.1,  # Encourage more diverse responses
+            frequency_penalty=0.1   # Reduce repetition
+        )
+
+    def ask(self, question: str):
+        """
+        Answer a question, from the answer cache when possible
+        
+        Args:
+            question: User's question about the parking app
+            
+        Returns:
+            (formatted response, "exact" | "semantic" cache hit or None)
+        """
+        try:
+            # Validate input
+            if not question or not question.strip():
+                return EMPTY_QUESTION_REPLY, None
+
+            cached, source, query_vec = self._lookup(question)
+            if cached is not None:
+                return cached, source
+
             # Generate response
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt()},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                presence_penalty=0.1,  # Encourage more diverse responses
-                frequency_penalty=0.1   # Reduce repetition
-            )
+            response = self.client.chat.completions.create(**self._completion_request(question, query_vec))
             
             # Extract and enhance the response
             raw_answer = response.choices[0].message.content
             enhanced_answer = self._enhance_response(raw_answer)
             
             logger.info("Response generated successfully")
-            return enhanced_answer
+            answer_cache.put(question, enhanced_answer, query_vec)
+            return enhanced_answer, None
             
         except Exception as e:
             logger.error(f"Error processing question: {e}")
-            return f"🚫 Sorry, I encountered an error while processing your question. Please try again!\n\nError details: {str(e)}"
+            return error_reply(e), None
+
+    def stream(self, question: str):
+        """
+        Answer a question while the completion is generated
+        
+        Args:
+            question: User's question about the parking app
+            
+        Yields:
+            ("delta", formatted text) as whole lines arrive, then ("done", cache hit kind or None),
+            or ("error", message) if the completion fails
+        """
+        try:
+            if not question or not question.strip():
+                yield "delta", EMPTY_QUESTION_REPLY
+                yield "done", None
+                return
+
+            cached, source, query_vec = self._lookup(question)
+            if cached is not None:
+                yield "delta", cached
+                yield "done", source
+                return
+
+            stream = self.client.chat.completions.create(stream=True, **self._completion_request(question, query_vec))
+            formatter = ResponseFormatter()
+            answer = []
+            for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                text = formatter.feed(token or "")
+                if text:
+                    answer.append(text)
+                    yield "delta", text
+            answer.append(formatter.finish())
+            yield "delta", answer[-1]
+
+            logger.info("Streamed response generated successfully")
+            answer_cache.put(question, "".join(answer), query_vec)
+            yield "done", None
+
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            yield "error", error_reply(e)
     
     def get_quick_help(self) -> str:
         """
@@ -285,6 +352,33 @@ def initialize_assistant(data_path: str = None) -> ParklyAssistant:
     return ParklyAssistant(data_path)
 
 
+_assistant = None
+_assistant_lock = threading.Lock()
+
+
+def get_assistant() -> ParklyAssistant:
+    """
+    Process-wide ParklyAssistant shared by all requests. Requests never embed the
+    manuals: the index stored by manage.py build_manual_index is memory-mapped on
+    first use and again whenever it is replaced. When the manuals change before it
+    is rebuilt, the previous index keeps answering. Raises ManualIndexMissing when
+    there is no index to start from.
+    """
+    global _assistant
+    assistant = _assistant
+    if assistant is None or assistant.store.is_stale():
+        with _assistant_lock:
+            if _assistant is assistant:
+                try:
+                    _assistant = ParklyAssistant(build_index=False)
+                except ManualIndexMissing:
+                    if assistant is None:
+                        raise
+                    logger.warning("Manuals changed: answering from the previous index until build_manual_index runs")
+            assistant = _assistant
+    return assistant
+
+
 # Backward compatibility function
 def ask_with_context(question: str) -> str:
     """
@@ -296,9 +390,7 @@ def ask_with_context(question: str) -> str:
     Returns:
         Formatted response
     """
-    # Create assistant instance
-    assistant = ParklyAssistant()
-    return assistant.ask_with_context(question)
+    return get_assistant().ask_with_context(question)
 
 
 # Example usage
@@ -1,32 +1,203 @@
+import glob
+import hashlib
+import json
 import os
+import tempfile
 import numpy as np
 import faiss
-from openai import OpenAI
 from django.conf import settings
 
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-EMBED_MODEL = "text-embedding-ada-002"
+from .embeddings import get_embedder
+from .retrieval import (
+    BM25, CHUNK_OVERLAP, CHUNK_SIZE, detect_language, manual_language, reciprocal_rank_fusion, split_manual,
+)
+
+# Every *.txt manual in this directory is indexed (parking_manual_ar.txt is tagged Arabic)
+MANUAL_DIR = os.path.join(os.path.dirname(__file__), "data")
+INDEX_FILE = "manual.faiss"
+CHUNKS_FILE = "chunks.json"
+# Exact search up to this many chunks, HNSW graph above
+HNSW_THRESHOLD = getattr(settings, 'RAGCHAT_HNSW_THRESHOLD', 2000)
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+# Candidates taken from each retriever before fusion
+SEARCH_CANDIDATES = 20
+
 
 def get_embeddings(texts):
-    result = client.embeddings.create(input=texts, model=EMBED_MODEL)
-    return [np.array(e.embedding, dtype='float32') for e in result.data]
+    return list(get_embedder().embed(texts))
+
+
+def index_dir():
+    return getattr(settings, 'RAGCHAT_INDEX_DIR', os.path.join(settings.BASE_DIR, 'ragchat_index'))
+
+
+def manual_files(source):
+    """The manual files behind `source`: the file itself, or every *.txt in the directory."""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.txt")))
+    return [source]
+
+
+def manual_hash(paths):
+    """Identifies what the stored index was built from: manual texts, embedding model and chunking."""
+    digest = hashlib.sha256(f"{get_embedder().model}:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{HNSW_THRESHOLD}:".encode())
+    for path in paths:
+        digest.update(f"{os.path.basename(path)}:".encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _mtimes(source):
+    return [(path, os.stat(path).st_mtime_ns) for path in manual_files(source)]
+
+
+def _file_version(path):
+    # The inode changes on every os.replace, even within the filesystem's timestamp granularity
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class ManualIndexMissing(Exception):
+    """No stored index matches the current manuals (see manage.py build_manual_index)."""
+
+
+def _write_atomic(path, write):
+    """
+    write(tmp_path) into a temp file unique to this call, then rename it over `path`:
+    workers rebuilding at the same time never interleave, readers never see half a file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 class ManualVectorStore:
-    def __init__(self, txt_path):
+    """
+    FAISS index over the chunks of the parking manuals, persisted in index_dir()
+    (the index itself plus a JSON file with the chunks and the manuals' hash).
+    The stored index is memory-mapped and reused as long as the hash matches;
+    otherwise it is rebuilt, which embeds every chunk.
+
+    Each chunk is a dict with its text, source file, section heading and language.
+    A BM25 keyword index over the same chunks is rebuilt in memory on load.
+
+    With build_missing=False (web workers) a missing or outdated index raises
+    ManualIndexMissing instead of being rebuilt.
+    """
+
+    def __init__(self, txt_path=MANUAL_DIR, directory=None, rebuild=False, build_missing=True):
         self.txt_path = txt_path
-        self.chunks = self.split_text(self.load_text())
-        self.embeddings = get_embeddings(self.chunks)
-        self.index = faiss.IndexFlatL2(len(self.embeddings[0]))
-        self.index.add(np.array(self.embeddings))
-
-    def load_text(self):
-        with open(self.txt_path, 'r', encoding='utf-8') as f:
-            return f.read()
-
-    def split_text(self, text, chunk_size=500):
-        return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-
-    def search(self, query, k=3):
-        query_vec = get_embeddings([query])[0]
-        D, I = self.index.search(np.array([query_vec]), k)
-        return [self.chunks[i] for i in I[0]]
+        self.directory = directory or index_dir()
+        self._mtimes = _mtimes(txt_path)
+        self.hash = manual_hash([path for path, _ in self._mtimes])
+        self.built = rebuild or not self.load()
+        if self.built:
+            if not (rebuild or build_missing):
+                raise ManualIndexMissing(
+                    f"No index of the current manuals in {self.directory}; run manage.py build_manual_index."
+                )
+            self.build()
+        self._index_version = _file_version(self.chunks_path)
+        self.bm25 = BM25([chunk['text'] for chunk in self.chunks])
+        self.languages = {chunk['lang'] for chunk in self.chunks}
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    @property
+    def chunks_path(self):
+        return os.path.join(self.directory, CHUNKS_FILE)
+
+    def load(self):
+        """Use the stored index if it was built from the current manual. Returns whether it was."""
+        try:
+            with open(self.chunks_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if meta.get('hash') != self.hash or not os.path.exists(self.index_path):
+            return False
+        self.chunks = meta['chunks']
+        self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+        if isinstance(self.index, faiss.IndexHNSW):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+        return True
+
+    def build(self):
+        self.chunks = []
+        for path in manual_files(self.txt_path):
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            lang = manual_language(path, text)
+            self.chunks.extend(
+                {'text': chunk, 'section': section, 'source': os.path.basename(path), 'lang': lang}
+                for section, chunk in self.split_text(text)
+            )
+        self.embeddings = np.array(get_embeddings([chunk['text'] for chunk in self.chunks]), dtype='float32')
+        dimension = self.embeddings.shape[1]
+        if len(self.chunks) > HNSW_THRESHOLD:
+            self.index = faiss.IndexHNSWFlat(dimension, HNSW_NEIGHBORS)
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+        else:
+            self.index = faiss.IndexFlatL2(dimension)
+        self.index.add(self.embeddings)
+        self.save()
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Index first, then the metadata that marks it as current
+        _write_atomic(self.index_path, lambda path: faiss.write_index(self.index, path))
+
+        def write_chunks(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'hash': self.hash, 'model': get_embedder().model, 'chunks': self.chunks}, f, ensure_ascii=False)
+
+        _write_atomic(self.chunks_path, write_chunks)
+
+    def is_stale(self):
+        """
+        True once the manuals on disk no longer match this index, or the stored index
+        was replaced (by build_manual_index). Cheap stat checks first.
+        """
+        try:
+            mtimes = _mtimes(self.txt_path)
+            index_version = _file_version(self.chunks_path)
+        except FileNotFoundError:
+            return False
+        index_replaced = index_version != self._index_version
+        if not index_replaced and (mtimes == self._mtimes or not mtimes):
+            return False
+        self._mtimes, self._index_version = mtimes, index_version
+        return index_replaced or manual_hash([path for path, _ in mtimes]) != self.hash
+
+    def split_text(self, text, chunk_size=CHUNK_SIZE):
+        return split_manual(text, chunk_size)
+
+    def embed_query(self, query):
+        return get_embeddings([query])[0]
+
+    def search(self, query, k=3, query_vec=None):
+        """
+        Texts of the k best chunks for the query: vector and BM25 rankings merged by
+        reciprocal rank fusion, restricted to the query's language when the manuals cover it.
+        """
+        if query_vec is None:
+            query_vec = self.embed_query(query)
+        candidates = min(max(SEARCH_CANDIDATES, k), len(self.chunks))
+        D, I = self.index.search(np.array([query_vec], dtype='float32'), candidates)
+        vector_ranking = [int(i) for i in I[0] if i >= 0]
+        keyword_ranking = self.bm25.rank(query, candidates)
+
+        lang = detect_language(query)
+        ranked = reciprocal_rank_fusion([vector_ranking, keyword_ranking])
+        if lang in self.languages:
+            ranked = [i for i in ranked if self.chunks[i]['lang'] == lang]
+        return [self.chunks[i]['text'] for i in ranked[:k]]
@@ -1,11 +1,76 @@
-from rest_framework.decorators import api_view
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from .utils import ask_with_context
+from .answer_cache import answer_cache
+from .utils import get_assistant
+from .vector_store import ManualIndexMissing
 
 @api_view(["POST"])
 def rag_chat(request):
     question = request.data.get("question")
     if not question:
         return Response({"error": "Missing 'question'"}, status=400)
-    answer = ask_with_context(question)
-    return Response({"answer": answer})
+    try:
+        assistant = get_assistant()
+    except ManualIndexMissing as e:
+        return Response({"error": str(e)}, status=503)
+    answer, cached = assistant.ask(question)
+    return Response({"answer": answer, "cached": cached})
+
+
+_END = object()
+
+
+async def _in_thread(iterator):
+    """Iterate a blocking iterator (the OpenAI stream) without blocking the event loop."""
+    while True:
+        item = await sync_to_async(next, thread_sensitive=False)(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+@csrf_exempt
+async def rag_chat_stream(request):
+    """
+    Server-Sent Events version of rag_chat, for ASGI: GET ?question=... (EventSource)
+    or POST {"question": ...}. Formatted text arrives as `data: {"delta": ...}` events,
+    followed by `event: done` (with the cache hit kind) or `event: error`.
+    """
+    if request.method == "POST":
+        try:
+            question = json.loads(request.body or b"{}").get("question")
+        except (ValueError, AttributeError):
+            question = None
+    else:
+        question = request.GET.get("question")
+    if not question:
+        return JsonResponse({"error": "Missing 'question'"}, status=400)
+
+    try:
+        assistant = await sync_to_async(get_assistant, thread_sensitive=False)()
+    except ManualIndexMissing as e:
+        return JsonResponse({"error": str(e)}, status=503)
+
+    async def events():
+        async for event, data in _in_thread(assistant.stream(question)):
+            if event == "delta":
+                yield f"data: {json.dumps({'delta': data})}\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps({'cached': data} if event == 'done' else {'error': data})}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def answer_cache_stats(request):
+    return Response(answer_cache.stats())
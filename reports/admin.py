@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import ReportJob
 
-# Register your models here.
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'garage', 'email', 'week_start', 'status', 'progress', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('garage__name', 'email')
+    readonly_fields = ('progress', 'stage', 'error', 'created_at', 'updated_at')
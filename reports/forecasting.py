@@ -0,0 +1,333 @@
+"""
+Per-garage booking and revenue forecasts.
+
+Models are trained in the background (reports.tasks.train_forecast_models, nightly)
+on the dense daily totals of each garage's history and persisted with joblib, one
+file per garage, together with that history and a hash of it. The next run only
+aggregates the days since the last one and refits when the history changed.
+Requests just load the artifact, which stays cached in-process until the file on
+disk is replaced; garages that have none yet forecast zeros while ForecastAPIView
+queues their training. Only report jobs, which already run in a worker, train inline.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import joblib
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from sklearn.ensemble import RandomForestRegressor
+
+from booking.models import Booking
+
+logger = logging.getLogger(__name__)
+
+# Bump when the features or the model change; older artifacts are then rebuilt from scratch
+MODEL_VERSION = 1
+# Trailing days re-aggregated on every update: a booking's actual_cost is only set on exit,
+# which can be a day after it was created
+REFRESH_DAYS = 2
+# Days averaged into the "recent bookings" feature
+ROLLING_WINDOW = 7
+FORECAST_DAYS = 7
+MAX_FORECAST_DAYS = 30
+
+
+def day_index(first_day, days):
+    """Position in reports.utils.DAYS (Saturday = 0) of `days` consecutive days from first_day."""
+    # 1970-01-01 was a Thursday, DAYS[5]
+    return (np.datetime64(first_day, 'D').astype(np.int64) + np.arange(days) + 5) % 7
+
+
+class DailyTotals(namedtuple('DailyTotals', 'first_day counts revenue')):
+    """
+    Dense per-day booking counts and revenue (local dates) starting at first_day.
+    counts/revenue are NumPy arrays with one slot per day, zero when nothing happened.
+    """
+
+    __slots__ = ()
+
+    @property
+    def days(self):
+        return np.datetime64(self.first_day, 'D') + np.arange(len(self.counts))
+
+    @property
+    def last_day(self):
+        return self.first_day + datetime.timedelta(days=len(self.counts) - 1)
+
+    @property
+    def day_index(self):
+        return day_index(self.first_day, len(self.counts))
+
+    def by_weekday(self, values):
+        return np.bincount(self.day_index, weights=values, minlength=7)
+
+    def to_message(self):
+        return [self.first_day.isoformat(), self.counts.tolist(), self.revenue.tolist()]
+
+    @classmethod
+    def from_message(cls, data):
+        first_day, counts, revenue = data
+        return cls(
+            datetime.date.fromisoformat(first_day),
+            np.asarray(counts, dtype=np.int64),
+            np.asarray(revenue, dtype=np.float64),
+        )
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def daily_totals(garage_ids, start, end):
+    """
+    Bookings created in [start, end) per garage and local day, aggregated in SQL
+    (TruncDate + Count/Sum) in one grouped query for all garages.
+    Returns {garage_id: DailyTotals}.
+    """
+    first_day = timezone.localtime(start).date()
+    last_day = timezone.localtime(end - datetime.timedelta(microseconds=1)).date()
+    size = max((last_day - first_day).days + 1, 0)
+    totals = {
+        garage_id: DailyTotals(first_day, np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.float64))
+        for garage_id in garage_ids
+    }
+    rows = (
+        Booking.objects.filter(garage__in=garage_ids, created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate('created_at'))
+        .values('garage_id', 'day')
+        .annotate(count=Count('id'), revenue=Sum('actual_cost'))
+        .order_by()
+    )
+    for row in rows:
+        i = (row['day'] - first_day).days
+        totals[row['garage_id']].counts[i] = row['count']
+        totals[row['garage_id']].revenue[i] = float(row['revenue'] or 0)
+    return totals
+
+
+def _is_weekend(day_index):
+    # Friday and Saturday
+    return np.isin(day_index, [0, 6]).astype(np.int64)
+
+
+def rolling_mean(values, window=ROLLING_WINDOW):
+    """Mean of the `window` values before each position (0 until there are that many), from one cumsum."""
+    sums = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    means = np.zeros(len(values))
+    means[window:] = (sums[window:-1] - sums[:-window - 1]) / window
+    return means
+
+
+def build_features(history):
+    """
+    One row per day of `history`: weekday (DAYS index), weekend flag, days since
+    history.first_day and the mean bookings of the previous ROLLING_WINDOW days.
+    """
+    index = history.day_index
+    return np.column_stack([
+        index, _is_weekend(index), np.arange(len(index)), rolling_mean(history.counts),
+    ]).astype(np.float64)
+
+
+def future_features(histories, start, days):
+    """
+    Feature rows for `days` days from `start` for several garages at once, shape
+    (len(histories), days, 4). The recent average is the last known week of each history.
+    """
+    index = day_index(start, days)
+    offsets = np.array([(start - history.first_day).days for history in histories])
+    recent = np.array([history.counts[-ROLLING_WINDOW:].mean() for history in histories])
+    shape = (len(histories), days)
+    return np.stack([
+        np.broadcast_to(index, shape),
+        np.broadcast_to(_is_weekend(index), shape),
+        offsets[:, None] + np.arange(days),
+        np.broadcast_to(recent[:, None], shape),
+    ], axis=-1).astype(np.float64)
+
+
+def history_hash(history):
+    digest = hashlib.sha256(f"{MODEL_VERSION}:{history.first_day.isoformat()}:".encode())
+    digest.update(history.counts.astype(np.int64).tobytes())
+    digest.update(history.revenue.astype(np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def fit_model(history):
+    """One multi-output forest predicting [bookings, revenue] per day."""
+    model = RandomForestRegressor(n_estimators=100, random_state=42)
+    model.fit(build_features(history), np.column_stack([history.counts, history.revenue]))
+    return model
+
+
+def model_dir():
+    return getattr(settings, 'FORECAST_MODEL_DIR', os.path.join(settings.BASE_DIR, 'forecast_models'))
+
+
+def model_path(garage_id):
+    return os.path.join(model_dir(), f"garage_{garage_id}.joblib")
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_artifact(garage_id):
+    """
+    The garage's stored artifact, or None if it was never trained. Cached per process
+    and reloaded only when the file's mtime changes.
+    """
+    path = model_path(garage_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    artifact = joblib.load(path)
+    with _cache_lock:
+        _cache[path] = (mtime, artifact)
+    return artifact
+
+
+def save_artifact(artifact):
+    path = model_path(artifact['garage_id'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique temp file per call (concurrent threads included), renamed over the artifact
+    # so readers never see a half written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            joblib.dump(artifact, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _full_histories(garage_ids, end):
+    """Whole history up to `end` for garages without a usable artifact."""
+    first = Booking.objects.filter(garage__in=garage_ids, created_at__lt=end).aggregate(first=Min('created_at'))['first']
+    if first is None:
+        return {}
+    histories = {}
+    for garage_id, totals in daily_totals(garage_ids, first, end).items():
+        booked = np.flatnonzero(totals.counts)
+        if booked.size:
+            start = booked[0]
+            histories[garage_id] = DailyTotals(
+                totals.first_day + datetime.timedelta(days=int(start)), totals.counts[start:], totals.revenue[start:]
+            )
+    return histories
+
+
+def _appended_histories(artifacts, end):
+    """Stored histories with their last REFRESH_DAYS and any newer days re-aggregated."""
+    refresh_from = {
+        garage_id: max(a['history'].first_day, a['history'].last_day - datetime.timedelta(days=REFRESH_DAYS - 1))
+        for garage_id, a in artifacts.items()
+    }
+    since = min(refresh_from.values())
+    recent = daily_totals(list(artifacts), _local_midnight(since), end)
+    histories = {}
+    for garage_id, artifact in artifacts.items():
+        old, new = artifact['history'], recent[garage_id]
+        keep = (refresh_from[garage_id] - old.first_day).days
+        skip = (refresh_from[garage_id] - since).days
+        histories[garage_id] = DailyTotals(
+            old.first_day,
+            np.concatenate([old.counts[:keep], new.counts[skip:]]),
+            np.concatenate([old.revenue[:keep], new.revenue[skip:]]),
+        )
+    return histories
+
+
+def train_models(garage_ids, today=None):
+    """
+    Bring the artifacts of `garage_ids` up to date with every complete day before
+    `today`. Returns how many models were (re)fitted.
+    """
+    today = today or timezone.localdate()
+    end = _local_midnight(today)
+    artifacts = {garage_id: load_artifact(garage_id) for garage_id in garage_ids}
+    current = {
+        garage_id: artifact for garage_id, artifact in artifacts.items()
+        if artifact and artifact['version'] == MODEL_VERSION and artifact['history'] is not None
+    }
+    stale = [garage_id for garage_id in garage_ids if garage_id not in current]
+
+    histories = _full_histories(stale, end) if stale else {}
+    if current:
+        histories.update(_appended_histories(current, end))
+
+    trained = 0
+    for garage_id in garage_ids:
+        history = histories.get(garage_id)
+        window_hash = history_hash(history) if history is not None else None
+        artifact = artifacts[garage_id]
+        if artifact and artifact['version'] == MODEL_VERSION and artifact['window_hash'] == window_hash:
+            continue
+        save_artifact({
+            'version': MODEL_VERSION,
+            'garage_id': garage_id,
+            'history': history,
+            'window_hash': window_hash,
+            'model': fit_model(history) if history is not None else None,
+            'trained_at': timezone.now(),
+        })
+        trained += 1
+    logger.info("Forecast models: %d of %d garages refitted", trained, len(garage_ids))
+    return trained
+
+
+def empty_forecast(today, days):
+    return DailyTotals(today, np.zeros(days, dtype=np.int64), np.zeros(days))
+
+
+def forecast_many(garage_ids, days=FORECAST_DAYS, today=None, train_missing=True):
+    """
+    {garage_id: DailyTotals} of predicted bookings and revenue for `days` days from
+    `today`. Garages the nightly job hasn't trained yet are fitted on the spot, or
+    map to None with train_missing=False (for requests, which must not train).
+    """
+    today = today or timezone.localdate()
+    artifacts = {garage_id: load_artifact(garage_id) for garage_id in garage_ids}
+    untrained = [
+        garage_id for garage_id, artifact in artifacts.items()
+        if artifact is None or artifact['version'] != MODEL_VERSION
+    ]
+    if untrained and train_missing:
+        train_models(untrained, today)
+        artifacts.update((garage_id, load_artifact(garage_id)) for garage_id in untrained)
+        untrained = []
+
+    forecasts = {garage_id: empty_forecast(today, days) for garage_id in garage_ids}
+    forecasts.update(dict.fromkeys(untrained))
+    trained = [
+        (garage_id, artifact) for garage_id, artifact in artifacts.items()
+        if garage_id not in untrained and artifact['model'] is not None
+    ]
+    if trained:
+        features = future_features([artifact['history'] for _, artifact in trained], today, days)
+        for (garage_id, artifact), rows in zip(trained, features):
+            predicted = artifact['model'].predict(rows)
+            forecasts[garage_id] = DailyTotals(
+                today,
+                np.maximum(0, np.rint(predicted[:, 0])).astype(np.int64),
+                np.maximum(0, np.round(predicted[:, 1], 2)),
+            )
+    return forecasts
+
+
+def forecast(garage_id, days=FORECAST_DAYS, today=None):
+    return forecast_many([garage_id], days, today)[garage_id]
@@ -1,3 +1,45 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+from garage.models import Garage
+
+
+class ReportJob(models.Model):
+    """A weekly report generated and emailed in the background (reports.tasks.run_report_job)."""
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    KIND_CHOICES = [
+        ('on_demand', 'On demand'),
+        ('scheduled', 'Scheduled'),
+    ]
+
+    # Not sequential: the stored PDF is named after it (reports/<id>.pdf)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    garage = models.ForeignKey(Garage, on_delete=models.CASCADE, related_name='report_jobs')
+    email = models.EmailField()
+    week_start = models.DateField(help_text="Saturday the reported week starts on")
+    # Scheduled jobs cover week_start..week_start + 7 days; on-demand ones the 7 days before they run
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='on_demand')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0, help_text="0-100")
+    stage = models.CharField(max_length=50, blank=True)
+    error = models.TextField(blank=True)
+    pdf = models.FileField(upload_to='reports/', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Deduplication lookups in GenerateWeeklyReportAPIView and schedule_weekly_reports
+            models.Index(fields=['garage', 'week_start', 'email', 'kind', 'status'], name='reportjob_dedupe_idx'),
+        ]
+
+    def __str__(self):
+        return f"Report {self.id} for {self.garage_id} ({self.week_start}, {self.status})"
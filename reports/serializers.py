@@ -1,5 +1,32 @@
+from django.urls import reverse
 from rest_framework import serializers
 
+from .forecasting import FORECAST_DAYS, MAX_FORECAST_DAYS
+from .models import ReportJob
+
 class ReportRequestSerializer(serializers.Serializer):
     garage_id = serializers.IntegerField()
     email = serializers.EmailField()
+
+
+class ForecastQuerySerializer(serializers.Serializer):
+    # Omitted: every garage of the requesting owner
+    garage_id = serializers.ListField(child=serializers.IntegerField(), required=False)
+    days = serializers.IntegerField(min_value=1, max_value=MAX_FORECAST_DAYS, default=FORECAST_DAYS)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+    status_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            'job_id', 'garage', 'email', 'week_start', 'kind', 'status',
+            'progress', 'stage', 'error', 'pdf', 'created_at', 'status_url',
+        ]
+
+    def get_status_url(self, obj):
+        url = reverse('report-job-status', args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,150 @@
+import datetime
+import logging
+import time
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from garage.models import Garage
+from . import forecasting
+from .models import ReportJob
+from .utils import (
+    DailyTotals, build_and_send_report, daily_totals, generate_and_send_report, week_start_for,
+    weekly_report_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# The scheduled fan-out splits the garages into at most this many chunk tasks,
+# which bounds how many report workers it keeps busy at once
+WEEKLY_REPORT_PARALLELISM = getattr(settings, "WEEKLY_REPORT_PARALLELISM", 8)
+
+
+def _run_job(job_id, build):
+    """
+    Claim a queued ReportJob, run build(job, progress) -> pdf bytes and store the outcome.
+    Returns True on success; a job that isn't queued any more (duplicate delivery) is skipped.
+    """
+    if not ReportJob.objects.filter(pk=job_id, status='queued').update(status='running', stage='starting'):
+        return False
+
+    job = ReportJob.objects.select_related('garage').get(pk=job_id)
+
+    def progress(percent, stage):
+        ReportJob.objects.filter(pk=job_id).update(progress=percent, stage=stage)
+
+    try:
+        pdf = build(job, progress)
+        if pdf is None:
+            raise ValueError(f"Garage with ID {job.garage_id} not found.")
+    except Exception as e:
+        logger.exception("Report job %s failed", job_id)
+        ReportJob.objects.filter(pk=job_id).update(status='failed', error=str(e))
+        return False
+
+    # Named after the random job id so the file URL cannot be guessed from the garage and week
+    job.pdf.save(f"{job.id}.pdf", ContentFile(pdf), save=False)
+    ReportJob.objects.filter(pk=job_id).update(status='succeeded', progress=100, stage='done', pdf=job.pdf.name)
+    return True
+
+
+@shared_task
+def run_report_job(job_id):
+    _run_job(job_id, lambda job, progress: generate_and_send_report(job.garage_id, job.email, progress=progress))
+
+
+@shared_task
+def train_forecast_models(garage_ids=None):
+    """
+    Nightly: refit the forecast model of every verified garage on the days since its last run.
+    ForecastAPIView also queues it with the garages it found untrained.
+    """
+    if garage_ids is None:
+        garage_ids = list(Garage.objects.filter(verification_status='Verified').values_list('id', flat=True))
+    return forecasting.train_models(garage_ids)
+
+
+@shared_task
+def schedule_weekly_reports():
+    """
+    Celery beat entry point: one report per verified garage for the week that just ended,
+    mailed to the owner. The per-day totals of all garages are aggregated here in one
+    query; the chunk tasks get job ids, garage ids and those totals (a few numbers per
+    garage, so messages stay small however busy the garages are) and load their own
+    garages' bookings in one query per chunk.
+    """
+    started = time.time()
+    week_start = week_start_for(timezone.localdate()) - datetime.timedelta(days=7)
+    start = timezone.make_aware(datetime.datetime.combine(week_start, datetime.time.min))
+    end = start + datetime.timedelta(days=7)
+
+    garages = list(Garage.objects.filter(verification_status='Verified').values_list('id', 'owner__email'))
+    done = set(
+        ReportJob.objects.filter(week_start=week_start, kind='scheduled')
+        .exclude(status='failed')
+        .values_list('garage_id', 'email')
+    )
+    jobs = ReportJob.objects.bulk_create(
+        ReportJob(garage_id=garage_id, email=email, week_start=week_start, kind='scheduled')
+        for garage_id, email in garages
+        if email and (garage_id, email) not in done
+    )
+    if not jobs:
+        logger.info("Weekly reports for %s: nothing to do", week_start)
+        return 0
+
+    totals = daily_totals([job.garage_id for job in jobs], start, end)
+    payloads = [(str(job.id), job.garage_id, totals[job.garage_id].to_message()) for job in jobs]
+    chunk_count = min(WEEKLY_REPORT_PARALLELISM, len(payloads))
+    chunks = [payloads[i::chunk_count] for i in range(chunk_count)]
+
+    chord(generate_report_chunk.s(chunk, start.isoformat(), end.isoformat()) for chunk in chunks)(
+        finish_weekly_reports.s(started, str(week_start))
+    )
+    logger.info("Weekly reports for %s: %d garages in %d chunks", week_start, len(jobs), chunk_count)
+    return len(jobs)
+
+
+@shared_task
+def generate_report_chunk(payloads, start, end):
+    """
+    Render and send the reports of one chunk in sequence, for bookings created in [start, end).
+    Returns (succeeded, failed).
+    """
+    start = datetime.datetime.fromisoformat(start)
+    now = end = datetime.datetime.fromisoformat(end)
+    started = time.time()
+    rows = weekly_report_rows([garage_id for _, garage_id, _ in payloads], start, end)
+    succeeded = failed = 0
+    for job_id, garage_id, totals in payloads:
+        bookings = rows[garage_id]
+        totals = DailyTotals.from_message(totals)
+        ok = _run_job(
+            job_id, lambda job, progress: build_and_send_report(job.garage, bookings, totals, job.email, now, progress)
+        )
+        if ok:
+            succeeded += 1
+        else:
+            failed += 1
+
+    elapsed = time.time() - started
+    logger.info(
+        "Report chunk: %d ok, %d failed in %.1fs (%.1f reports/min)",
+        succeeded, failed, elapsed, 60 * succeeded / elapsed if elapsed else 0,
+    )
+    return succeeded, failed
+
+
+@shared_task
+def finish_weekly_reports(results, started, week_start):
+    succeeded = sum(ok for ok, _ in results)
+    failed = sum(bad for _, bad in results)
+    elapsed = time.time() - started
+    rate = 60 * succeeded / elapsed if elapsed else 0
+    logger.info(
+        "Weekly reports for %s done: %d sent, %d failed in %.1fs (%.1f reports/min)",
+        week_start, succeeded, failed, elapsed, rate,
+    )
+    return {"week_start": week_start, "succeeded": succeeded, "failed": failed, "seconds": elapsed, "reports_per_minute": rate}
@@ -1,3 +1,325 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from booking.models import Booking
+from garage.tests import make_garage, make_owner
+from .models import ReportJob
+from . import forecasting
+from .tasks import generate_report_chunk, run_report_job, schedule_weekly_reports, train_forecast_models
+from .utils import DailyTotals, ReportRow, daily_totals, week_start_for, weekly_report_rows
+
+
+@mock.patch('reports.views.run_report_job')
+class GenerateWeeklyReportAPIViewTests(TestCase):
+    url = '/api/reports/weekly/'
+
+    def setUp(self):
+        self.owner = make_owner()
+        self.garage = make_garage(self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def request_report(self, email="owner@example.com"):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, {'garage_id': self.garage.id, 'email': email}, format='json')
+
+    def test_queues_job_and_returns_202(self, task):
+        response = self.request_report()
+
+        self.assertEqual(response.status_code, 202)
+        job = ReportJob.objects.get()
+        self.assertEqual(response.data['job_id'], str(job.id))
+        self.assertFalse(response.data['deduplicated'])
+        self.assertEqual(job.week_start.weekday(), 5)
+        task.delay.assert_called_once_with(str(job.id))
+
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.data['status'], 'queued')
+
+    def test_duplicate_requests_share_a_job(self, task):
+        first = self.request_report()
+        second = self.request_report()
+
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+        self.assertTrue(second.data['deduplicated'])
+        task.delay.assert_called_once()
+
+        self.assertNotEqual(self.request_report("other@example.com").data['job_id'], first.data['job_id'])
+
+    def test_finished_jobs_are_not_reused(self, task):
+        for status in ('failed', 'succeeded'):
+            first = self.request_report()
+            ReportJob.objects.filter(pk=first.data['job_id']).update(status=status)
+
+            second = self.request_report()
+            self.assertNotEqual(second.data['job_id'], first.data['job_id'])
+            self.assertFalse(second.data['deduplicated'])
+            ReportJob.objects.filter(pk=second.data['job_id']).update(status=status)
+
+    def test_only_the_garage_owner(self, task):
+        job_id = self.request_report().data['job_id']
+        status_url = f'/api/reports/jobs/{job_id}/'
+
+        self.client.force_authenticate(make_owner(2))
+        self.assertEqual(self.request_report().status_code, 404)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.request_report().status_code, 401)
+        self.assertEqual(self.client.get(status_url).status_code, 401)
+        task.delay.assert_called_once()
+
+    def test_unknown_garage(self, task):
+        response = self.client.post(self.url, {'garage_id': 999, 'email': "owner@example.com"}, format='json')
+        self.assertEqual(response.status_code, 404)
+        task.delay.assert_not_called()
+
+
+class RunReportJobTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.job = ReportJob.objects.create(
+            garage=make_garage(make_owner()), email="owner@example.com", week_start="2026-01-03"
+        )
+
+    def test_success_stores_pdf(self):
+        def fake_report(garage_id, email, progress):
+            progress(50, "charts")
+            return b"%PDF-1.4"
+
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                mock.patch('reports.tasks.generate_and_send_report', side_effect=fake_report):
+            run_report_job(self.job.id)
+            # A second delivery of the same message does nothing
+            run_report_job(self.job.id)
+
+            self.job.refresh_from_db()
+            self.assertEqual((self.job.status, self.job.progress), ('succeeded', 100))
+            self.assertEqual(self.job.pdf.name, f"reports/{self.job.id}.pdf")
+            self.assertEqual(self.job.pdf.read(), b"%PDF-1.4")
+
+    def test_failure_is_recorded(self):
+        with mock.patch('reports.tasks.generate_and_send_report', side_effect=RuntimeError("SMTP down")), \
+                self.assertLogs('reports.tasks', level='ERROR'):
+            run_report_job(self.job.id)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.error), ('failed', "SMTP down"))
+
+
+class ScheduleWeeklyReportsTests(TestCase):
+    def setUp(self):
+        self.owner = make_owner()
+        self.garages = [make_garage(self.owner, f"Garage {i}") for i in range(3)]
+        make_garage(self.owner, "Unverified", verification_status='Pending')
+        driver = CustomUser.objects.create_user(
+            email="driver@example.com", password=None, username="driver",
+            phone="01200000001", national_id="20000000000001", role='driver',
+        )
+        last_week = timezone.now() - datetime.timedelta(days=7)
+        for garage in self.garages[:2]:
+            booking = Booking.objects.create(
+                driver=driver, garage=garage, parking_spot=garage.spots.first(),
+                reservation_expiry_time=last_week, actual_cost=20, status='completed',
+            )
+            Booking.objects.filter(pk=booking.pk).update(created_at=last_week)
+
+    def test_on_demand_jobs_do_not_replace_the_scheduled_report(self):
+        week_start = week_start_for(timezone.localdate()) - datetime.timedelta(days=7)
+        ReportJob.objects.create(garage=self.garages[0], email=self.owner.email, week_start=week_start)
+
+        with mock.patch('reports.tasks.chord'):
+            self.assertEqual(schedule_weekly_reports(), 3)
+        self.assertEqual(ReportJob.objects.filter(kind='scheduled').count(), 3)
+
+    def test_fan_out_ships_ids_and_totals_only(self):
+        with mock.patch('reports.tasks.chord') as chord, self.assertNumQueries(4):
+            self.assertEqual(schedule_weekly_reports(), 3)
+
+        signatures = list(chord.call_args.args[0])
+        chunks = [sig.args[0] for sig in signatures]
+        payloads = {job_id: garage_id for chunk in chunks for job_id, garage_id, _ in chunk}
+        self.assertEqual(len(payloads), 3)
+        jobs = {str(job.id): job for job in ReportJob.objects.all()}
+        self.assertEqual({job.email for job in jobs.values()}, {self.owner.email})
+        self.assertEqual({job_id: job.garage_id for job_id, job in jobs.items()}, payloads)
+
+        # Already scheduled for that week
+        with mock.patch('reports.tasks.chord') as chord:
+            self.assertEqual(schedule_weekly_reports(), 0)
+        chord.assert_not_called()
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with mock.patch('reports.tasks.build_and_send_report', return_value=b"%PDF") as build, \
+                mock.patch('reports.tasks.weekly_report_rows', wraps=weekly_report_rows) as load_rows, \
+                override_settings(MEDIA_ROOT=media_root):
+            for sig in signatures:
+                self.assertEqual(generate_report_chunk(*sig.args), (len(sig.args[0]), 0))
+        # One bookings query per chunk
+        self.assertEqual(load_rows.call_count, len(chunks))
+        rows_per_garage = {call.args[0].id: call.args[1] for call in build.call_args_list}
+        self.assertEqual(
+            {garage_id: len(rows) for garage_id, rows in rows_per_garage.items()},
+            {self.garages[0].id: 1, self.garages[1].id: 1, self.garages[2].id: 0},
+        )
+        self.assertTrue(all(isinstance(row, ReportRow) for rows in rows_per_garage.values() for row in rows))
+        totals = [call.args[2] for call in build.call_args_list]
+        self.assertTrue(all(isinstance(t, DailyTotals) and len(t.counts) == 7 for t in totals))
+
+
+class DailyTotalsTests(TestCase):
+    def test_dense_days_in_one_query(self):
+        owner = make_owner()
+        garage, empty = make_garage(owner, "Busy"), make_garage(owner, "Empty")
+        driver = CustomUser.objects.create_user(
+            email="driver@example.com", password=None, username="driver",
+            phone="01200000001", national_id="20000000000001", role='driver',
+        )
+        # Saturday 3 January 2026, local time
+        start = timezone.make_aware(datetime.datetime(2026, 1, 3))
+        for days, cost in [(0, 10), (0, None), (2, 5), (6, 7)]:
+            booking = Booking.objects.create(
+                driver=driver, garage=garage, parking_spot=garage.spots.first(),
+                reservation_expiry_time=start, actual_cost=cost, status='completed',
+            )
+            Booking.objects.filter(pk=booking.pk).update(created_at=start + datetime.timedelta(days=days, hours=12))
+
+        with self.assertNumQueries(1):
+            totals = daily_totals([garage.id, empty.id], start, start + datetime.timedelta(days=7))
+
+        busy = totals[garage.id]
+        self.assertEqual(busy.counts.tolist(), [2, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(busy.revenue.tolist(), [10, 0, 5, 0, 0, 0, 7])
+        self.assertEqual(busy.day_index.tolist(), list(range(7)))
+        self.assertEqual(busy.by_weekday(busy.counts).tolist(), [2, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(totals[empty.id].counts.sum(), 0)
+        self.assertEqual(DailyTotals.from_message(busy.to_message()).revenue.tolist(), busy.revenue.tolist())
+
+
+class ForecastModelTests(TestCase):
+    def setUp(self):
+        model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_dir, ignore_errors=True)
+        settings = override_settings(FORECAST_MODEL_DIR=model_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.garage = make_garage(make_owner())
+        self.driver = CustomUser.objects.create_user(
+            email="driver@example.com", password=None, username="driver",
+            phone="01200000001", national_id="20000000000001", role='driver',
+        )
+        self.today = datetime.date(2026, 2, 1)
+        for days_ago in range(1, 22):
+            for _ in range(days_ago % 3 + 1):
+                self.book(self.today - datetime.timedelta(days=days_ago))
+
+    def book(self, day, cost=10):
+        created = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+        booking = Booking.objects.create(
+            driver=self.driver, garage=self.garage, parking_spot=self.garage.spots.first(),
+            reservation_expiry_time=created, actual_cost=cost, status='completed',
+        )
+        Booking.objects.filter(pk=booking.pk).update(created_at=created)
+
+    def test_trains_once_and_serves_from_cache(self):
+        self.assertEqual(forecasting.train_models([self.garage.id], self.today), 1)
+        # Nothing new: the history hash is unchanged
+        self.assertEqual(forecasting.train_models([self.garage.id], self.today), 0)
+
+        with self.assertNumQueries(0):
+            result = forecasting.forecast(self.garage.id, days=7, today=self.today)
+        self.assertEqual((result.first_day, len(result.counts), len(result.revenue)), (self.today, 7, 7))
+        self.assertTrue((result.counts >= 0).all() and (result.revenue >= 0).all())
+
+    def test_new_days_are_appended(self):
+        forecasting.train_models([self.garage.id], self.today)
+        first = forecasting.load_artifact(self.garage.id)
+        self.book(self.today, cost=99)
+
+        tomorrow = self.today + datetime.timedelta(days=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(forecasting.train_models([self.garage.id], tomorrow), 1)
+
+        history = forecasting.load_artifact(self.garage.id)['history']
+        self.assertEqual(history.first_day, first['history'].first_day)
+        self.assertEqual(history.last_day, self.today)
+        self.assertEqual((history.counts[-1], history.revenue[-1]), (1, 99))
+        self.assertEqual(history.counts[:-1].tolist(), first['history'].counts.tolist())
+
+    def test_concurrent_saves_never_share_a_temp_file(self):
+        artifacts = [{'garage_id': self.garage.id, 'version': forecasting.MODEL_VERSION, 'n': n} for n in range(8)]
+        threads = [threading.Thread(target=forecasting.save_artifact, args=(artifact,)) for artifact in artifacts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        path = forecasting.model_path(self.garage.id)
+        self.assertIn(joblib.load(path), artifacts)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_garage_without_bookings_forecasts_zero(self):
+        empty = make_garage(make_owner(2), "Empty")
+        result = forecasting.forecast(empty.id, today=self.today)
+        self.assertEqual(result.counts.tolist(), [0] * 7)
+
+    def test_rolling_features_match_the_window_mean(self):
+        history = forecasting.daily_totals(
+            [self.garage.id], timezone.make_aware(datetime.datetime(2026, 1, 11)),
+            timezone.make_aware(datetime.datetime(2026, 2, 1)),
+        )[self.garage.id]
+        expected = [np.mean(history.counts[i - 7:i]) if i >= 7 else 0 for i in range(len(history.counts))]
+        self.assertTrue(np.allclose(forecasting.build_features(history)[:, 3], expected))
+
+    @mock.patch('reports.views.train_forecast_models')
+    def test_forecast_endpoint(self, train):
+        self.addCleanup(cache.clear)
+        other = make_garage(self.garage.owner, "Second")
+        client = APIClient()
+        client.force_authenticate(self.garage.owner)
+
+        # Untrained: zeros right away, training goes to the worker (once)
+        with mock.patch('django.utils.timezone.localdate', return_value=self.today), \
+                mock.patch('reports.forecasting.train_models') as train_inline:
+            for _ in range(2):
+                response = client.get('/api/reports/forecast/', {'days': 10})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([f['trained'] for f in response.data['forecasts']], [False, False])
+                self.assertEqual([f['total_bookings'] for f in response.data['forecasts']], [0, 0])
+        train_inline.assert_not_called()
+        train.delay.assert_called_once()
+        self.assertEqual(sorted(train.delay.call_args.args[0]), sorted([self.garage.id, other.id]))
+
+        with mock.patch('django.utils.timezone.localdate', return_value=self.today):
+            train_forecast_models([self.garage.id, other.id])
+            response = client.get('/api/reports/forecast/', {'days': 10})
+        self.assertEqual({f['garage_id'] for f in response.data['forecasts']}, {self.garage.id, other.id})
+        busy = next(f for f in response.data['forecasts'] if f['garage_id'] == self.garage.id)
+        self.assertTrue(busy['trained'])
+        self.assertEqual(len(busy['daily']), 10)
+        self.assertEqual(busy['daily'][0]['date'], str(self.today))
+        self.assertGreater(busy['total_bookings'], 0)
+
+        response = client.get('/api/reports/forecast/', {'garage_id': other.id})
+        self.assertEqual([f['total_bookings'] for f in response.data['forecasts']], [0])
+        train.delay.assert_called_once()
+
+        stranger = make_garage(make_owner(3), "Stranger")
+        response = client.get('/api/reports/forecast/', {'garage_id': [other.id, stranger.id]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(client.get('/api/reports/forecast/', {'days': 0}).status_code, 400)
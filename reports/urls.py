@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import GenerateWeeklyReportAPIView
+from .views import ForecastAPIView, GenerateWeeklyReportAPIView, ReportJobStatusAPIView
 
 urlpatterns = [
     path('weekly/', GenerateWeeklyReportAPIView.as_view(), name='generate-report'),
+    path('jobs/<uuid:job_id>/', ReportJobStatusAPIView.as_view(), name='report-job-status'),
+    path('forecast/', ForecastAPIView.as_view(), name='garage-forecast'),
 ]
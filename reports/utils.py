@@ -1,48 +1,34 @@
 import datetime
+from collections import namedtuple
 from io import BytesIO
-import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.ensemble import RandomForestRegressor
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
+from django.utils import timezone
 from xhtml2pdf import pisa
 
 from booking.models import Booking
+from .forecasting import DailyTotals, daily_totals, forecast as garage_forecast
 
 DAYS = ['Saturday', 'Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
 DAY_INDEX = {day: i for i, day in enumerate(DAYS)}
 
-def generate_graph(bookings):
-    daily_counts = {day: 0 for day in DAYS}
-    for booking in bookings:
-        day = booking.created_at.strftime('%A')
-        if day in daily_counts:
-            daily_counts[day] += 1
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(DAYS, [daily_counts[day] for day in DAYS], marker='o', linestyle='-', color='blue')
-    plt.title("\U0001F4CA Weekly Bookings")
-    plt.xlabel("Day")
-    plt.ylabel("Bookings")
-    plt.grid(True)
+def week_start_for(day):
+    """Saturday on or before `day`; reports run Saturday to Friday like DAYS."""
+    return day - datetime.timedelta(days=(day.weekday() - 5) % 7)
 
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    plt.close()
-    buffer.seek(0)
-    return buffer
 
-def generate_revenue_chart(bookings):
-    daily_revenue = {day: 0.0 for day in DAYS}
-    for booking in bookings:
-        day = booking.created_at.strftime('%A')
-        daily_revenue[day] += float(booking.actual_cost or 0)
+def _noop_progress(percent, stage):
+    pass
+
 
+def _line_chart(values, title, ylabel, color):
     plt.figure(figsize=(10, 5))
-    plt.plot(DAYS, [daily_revenue[day] for day in DAYS], marker='o', linestyle='-', color='purple')
-    plt.title("💰 Actual Revenue by Day")
+    plt.plot(DAYS, values, marker='o', linestyle='-', color=color)
+    plt.title(title)
     plt.xlabel("Day")
-    plt.ylabel("Revenue (EGP)")
+    plt.ylabel(ylabel)
     plt.grid(True)
 
     buffer = BytesIO()
@@ -51,116 +37,23 @@ def generate_revenue_chart(bookings):
     buffer.seek(0)
     return buffer
 
-def generate_predictions(garage_id):
-    bookings = Booking.objects.filter(garage_id=garage_id).order_by('created_at')
-    if not bookings:
-        return {day: 0 for day in DAYS}
-
-    start_date = bookings[0].created_at.date()
-    daily_counts = {}
-
-    # Count bookings per date
-    for booking in bookings:
-        booking_date = booking.created_at.date()
-        daily_counts[booking_date] = daily_counts.get(booking_date, 0) + 1
-
-    sorted_dates = sorted(daily_counts.keys())
-    features = []
-    targets = []
 
-    for i, current_date in enumerate(sorted_dates):
-        day_index = current_date.weekday()
-        is_weekend = 1 if day_index in [4, 5] else 0
-        days_since_start = (current_date - start_date).days
+def generate_graph(totals):
+    return _line_chart(totals.by_weekday(totals.counts), "\U0001F4CA Weekly Bookings", "Bookings", 'blue')
 
-        # Rolling average over past 7 days
-        if i >= 7:
-            past_week = sorted_dates[i-7:i]
-            avg_last_week = np.mean([daily_counts[d] for d in past_week])
-        else:
-            avg_last_week = 0.0
+def generate_revenue_chart(totals):
+    return _line_chart(totals.by_weekday(totals.revenue), "💰 Actual Revenue by Day", "Revenue (EGP)", 'purple')
 
-        features.append([day_index, is_weekend, days_since_start, avg_last_week])
-        targets.append(daily_counts[current_date])
-
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(features, targets)
-
-    # Predict for next 7 days (starting today)
-    future_predictions = {}
-    today = datetime.date.today()
-    for i in range(7):
-        future_date = today + datetime.timedelta(days=i)
-        day_index = future_date.weekday()
-        is_weekend = 1 if day_index in [4, 5] else 0
-        days_since_start = (future_date - start_date).days
-
-        # Estimate avg past 7 days as last known value or 0
-        recent_known = targets[-7:] if len(targets) >= 7 else targets
-        avg_last_week = np.mean(recent_known) if recent_known else 0
-
-        x = [[day_index, is_weekend, days_since_start, avg_last_week]]
-        pred = model.predict(x)[0]
-        future_predictions[DAYS[day_index]] = max(0, int(round(pred)))
-
-    return future_predictions
+def generate_predictions(forecast):
+    """{day name: predicted bookings} for a week of forecasting.forecast()."""
+    return {DAYS[i]: int(count) for i, count in zip(forecast.day_index, forecast.counts)}
 
 def generate_prediction_chart(predictions):
     values = [predictions.get(day, 0) for day in DAYS]
+    return _line_chart(values, "🔮 Predicted Bookings", "Predicted Bookings", 'green')
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(DAYS, values, marker='o', linestyle='-', color='green')
-    plt.title("🔮 Predicted Bookings")
-    plt.xlabel("Day")
-    plt.ylabel("Predicted Bookings")
-    plt.grid(True)
-
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    plt.close()
-    buffer.seek(0)
-    return buffer
-
-def generate_predicted_revenue_chart(bookings):
-    if not bookings:
-        predicted_revenue = {day: 0 for day in DAYS}
-    else:
-        features = []
-        targets = []
-        start_date = bookings[0].created_at.date()
-
-        for booking in bookings:
-            if booking.actual_cost:
-                day_index = DAY_INDEX[booking.created_at.strftime('%A')]
-                is_weekend = 1 if booking.created_at.weekday() in [4, 5] else 0
-                days_since_start = (booking.created_at.date() - start_date).days
-                features.append([day_index, is_weekend, days_since_start])
-                targets.append(float(booking.actual_cost))
-
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
-        model.fit(features, targets)
-
-        predicted_revenue = {}
-        for i, day in enumerate(DAYS):
-            day_index = i
-            is_weekend = 1 if day_index in [4, 5] else 0
-            days_since_start = (datetime.date.today() - start_date).days + i
-            x = [[day_index, is_weekend, days_since_start]]
-            pred = model.predict(x)[0]
-            predicted_revenue[day] = round(pred, 2)
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(DAYS, [predicted_revenue[day] for day in DAYS], marker='o', linestyle='-', color='orange')
-    plt.title("💡 Predicted Revenue")
-    plt.xlabel("Day")
-    plt.ylabel("Revenue (EGP)")
-    plt.grid(True)
-
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    plt.close()
-    buffer.seek(0)
-    return buffer
+def generate_predicted_revenue_chart(forecast):
+    return _line_chart(forecast.by_weekday(forecast.revenue), "💡 Predicted Revenue", "Revenue (EGP)", 'orange')
 
 def render_pdf(template_src, context_dict):
     html = render_to_string(template_src, context_dict)
@@ -170,9 +63,38 @@ def render_pdf(template_src, context_dict):
 
 from garage.models import Garage
 
-def generate_and_send_report(garage_id, email):
+
+class ReportRow(namedtuple('ReportRow', 'user created_at start_time end_time spot_number actual_cost')):
+    """One booking as the weekly report needs it."""
+
+    __slots__ = ()
+
+
+def weekly_report_rows(garage_ids, start, end=None):
+    """
+    Bookings created in [start, end) for all the given garages, in one query.
+    Returns {garage_id: [ReportRow, ...]} newest first.
+    """
+    queryset = Booking.objects.filter(garage__in=garage_ids, created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    rows = {garage_id: [] for garage_id in garage_ids}
+    values = queryset.order_by('-created_at').values_list(
+        'garage_id', 'driver__username', 'created_at', 'start_time', 'end_time', 'parking_spot__slot_number', 'actual_cost'
+    )
+    for garage_id, *fields in values:
+        rows[garage_id].append(ReportRow(*fields))
+    return rows
+
+
+def generate_and_send_report(garage_id, email, progress=_noop_progress):
+    """
+    Build the weekly PDF with its charts and mail it to `email`.
+    `progress(percent, stage)` is called between the slow steps. Returns the PDF bytes.
+    """
     now = datetime.datetime.now()
-    one_week_ago = now - datetime.timedelta(days=7)
+    end = timezone.now()
+    one_week_ago = end - datetime.timedelta(days=7)
 
     try:
         garage = Garage.objects.get(id=garage_id)
@@ -181,30 +103,37 @@ def generate_and_send_report(garage_id, email):
         print(f"Error: Garage with ID {garage_id} not found.")
         return 
 
-    bookings = Booking.objects.select_related('driver', 'parking_spot').filter(
-        garage=garage, 
-        created_at__gte=one_week_ago
-    )
-    # ===================================================================
-
-    chart = generate_graph(bookings)
-    predictions = generate_predictions(garage_id)
+    bookings = weekly_report_rows([garage.id], one_week_ago, end)[garage.id]
+    totals = daily_totals([garage.id], one_week_ago, end)[garage.id]
+    return build_and_send_report(garage, bookings, totals, email, now, progress)
+
+
+def build_and_send_report(garage, bookings, totals, email, now, progress=_noop_progress):
+    """
+    Charts, PDF and email for one garage. Charts and the revenue total come from the
+    DailyTotals aggregate; the ReportRows only fill the PDF's booking table.
+    """
+    progress(10, "charts")
+    chart = generate_graph(totals)
+    progress(20, "predictions")
+    forecast = garage_forecast(garage.id)
+    predictions = generate_predictions(forecast)
     prediction_chart = generate_prediction_chart(predictions)
-    revenue_chart = generate_revenue_chart(bookings)
-    predicted_revenue_chart = generate_predicted_revenue_chart(bookings)
+    revenue_chart = generate_revenue_chart(totals)
+    progress(50, "revenue predictions")
+    predicted_revenue_chart = generate_predicted_revenue_chart(forecast)
 
-    total_revenue = 0
+    total_revenue = float(totals.revenue.sum())
     enriched_bookings = []
 
     for b in bookings:
         cost = float(b.actual_cost or 0)
-        total_revenue += cost
         enriched_bookings.append({
-            'user': b.driver.username if b.driver else 'Unknown',
+            'user': b.user or 'Unknown',
             'created_at': b.created_at,
             'start_time': b.start_time,
             'end_time': b.end_time,
-            'spot_number': b.parking_spot.slot_number if b.parking_spot else 'N/A',
+            'spot_number': b.spot_number or 'N/A',
             'actual_cost': f"{cost:.2f} EGP",
         })
 
@@ -216,6 +145,7 @@ def generate_and_send_report(garage_id, email):
         'garage_name': garage.name, 
     }
 
+    progress(70, "pdf")
     pdf = render_pdf('reports/weekly_report.html', context)
 
     email_msg = EmailMessage(
@@ -229,4 +159,6 @@ def generate_and_send_report(garage_id, email):
     email_msg.attach('prediction_chart.png', prediction_chart.getvalue(), 'image/png')
     email_msg.attach('revenue_chart.png', revenue_chart.getvalue(), 'image/png')
     email_msg.attach('predicted_revenue_chart.png', predicted_revenue_chart.getvalue(), 'image/png')
+    progress(90, "email")
     email_msg.send()
+    return pdf.getvalue()
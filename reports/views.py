@@ -1,18 +1,120 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import ReportRequestSerializer
-from .utils import generate_and_send_report
+
+from garage.models import Garage
+from .models import ReportJob
+from .forecasting import empty_forecast, forecast_many
+from .serializers import ForecastQuerySerializer, ReportJobSerializer, ReportRequestSerializer
+from .tasks import run_report_job, train_forecast_models
+from .utils import week_start_for
+
+FORECAST_TRAINING_KEY = "forecast_training:{}"
+FORECAST_TRAINING_TIMEOUT = 10 * 60
+
 
 class GenerateWeeklyReportAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
     def post(self, request):
         serializer = ReportRequestSerializer(data=request.data)
-        if serializer.is_valid():
-            garage_id = serializer.validated_data['garage_id']
-            email = serializer.validated_data['email']
-            try:
-                generate_and_send_report(garage_id, email)
-                return Response({"message": "Report sent successfully."})
-            except Exception as e:
-                return Response({"error": str(e)}, status=500)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        garage_id = serializer.validated_data['garage_id']
+        email = serializer.validated_data['email']
+        week_start = week_start_for(timezone.localdate())
+
+        with transaction.atomic():
+            # The garage row lock serializes concurrent requests for the same report
+            garage = Garage.objects.select_for_update().filter(id=garage_id, owner=request.user).first()
+            if garage is None:
+                return Response({"error": f"Garage with ID {garage_id} not found."}, status=status.HTTP_404_NOT_FOUND)
+
+            # Only jobs still in flight are shared: the report covers the 7 days before it runs,
+            # so a finished one is already out of date
+            job = ReportJob.objects.filter(
+                garage=garage, week_start=week_start, email=email, kind='on_demand', status__in=['queued', 'running']
+            ).first()
+            deduplicated = job is not None
+            if job is None:
+                job = ReportJob.objects.create(garage=garage, week_start=week_start, email=email)
+                transaction.on_commit(lambda: run_report_job.delay(str(job.id)), robust=True)
+
+        data = ReportJobSerializer(job, context={'request': request}).data
+        data['deduplicated'] = deduplicated
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+class ReportJobStatusAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ReportJob, pk=job_id, garage__owner=request.user)
+        return Response(ReportJobSerializer(job, context={'request': request}).data)
+
+
+def _forecast_data(garage, forecast, trained=True):
+    return {
+        'garage_id': garage.id,
+        'garage_name': garage.name,
+        # False until the queued training has produced a model: the numbers are all zero
+        'trained': trained,
+        'total_bookings': int(forecast.counts.sum()),
+        'total_revenue': round(float(forecast.revenue.sum()), 2),
+        'daily': [
+            {'date': str(day), 'bookings': int(count), 'revenue': float(revenue)}
+            for day, count, revenue in zip(forecast.days, forecast.counts, forecast.revenue)
+        ],
+    }
+
+
+class ForecastAPIView(APIView):
+    """
+    GET ?garage_id=1&garage_id=2&days=14 -> next `days` days of predicted bookings and
+    revenue for those garages (all of the owner's garages when garage_id is omitted).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        data = {'garage_id': request.query_params.getlist('garage_id')}
+        if 'days' in request.query_params:
+            data['days'] = request.query_params['days']
+        serializer = ForecastQuerySerializer(data=data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        garage_ids = serializer.validated_data.get('garage_id')
+        garages = Garage.objects.filter(owner=request.user).only('id', 'name')
+        if garage_ids:
+            garages = garages.filter(id__in=garage_ids)
+        garages = list(garages)
+        if not garages or set(garage_ids or ()) - {garage.id for garage in garages}:
+            return Response({"error": "Garage not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        days = serializer.validated_data['days']
+        today = timezone.localdate()
+        forecasts = forecast_many([garage.id for garage in garages], days, today, train_missing=False)
+
+        # Fitting a model is too slow for a request: train in the background, at most once
+        # per FORECAST_TRAINING_TIMEOUT per garage, and answer with zeros until then
+        untrained = [garage_id for garage_id, forecast in forecasts.items() if forecast is None]
+        queued = [
+            garage_id for garage_id in untrained
+            if cache.add(FORECAST_TRAINING_KEY.format(garage_id), True, FORECAST_TRAINING_TIMEOUT)
+        ]
+        if queued:
+            train_forecast_models.delay(queued)
+
+        return Response({
+            'days': days,
+            'forecasts': [
+                _forecast_data(garage, forecasts[garage.id] or empty_forecast(today, days), garage.id not in untrained)
+                for garage in garages
+            ],
+        })